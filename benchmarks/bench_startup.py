@@ -0,0 +1,74 @@
+"""
+Time fresh interpreters importing enscons and running the PEP 517 metadata
+hook, against the imports enscons avoids.
+
+    python benchmarks/bench_startup.py [--runs N] [--project DIR]
+
+--project is a directory with pyproject.toml (default: this checkout). If its
+metadata is not static, the metadata hook runs SCons, which writes build/
+there.
+Run `python -m compileall enscons` first if bytecode writing is disabled,
+or every run pays for compiling.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("python", "pass"),
+    ("import enscons", "import enscons"),
+    ("import enscons.api", "import enscons.api"),
+    (
+        "prepare_metadata_for_build_wheel",
+        "import enscons.api, tempfile; "
+        "enscons.api.prepare_metadata_for_build_wheel(tempfile.mkdtemp())",
+    ),
+    ("import SCons.Script", "import SCons.Script"),
+    ("import pkg_resources", "import pkg_resources"),
+]
+
+
+def run(code, cwd, env):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=cwd,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--project", default=ROOT)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [ROOT, os.environ.get("PYTHONPATH")])
+    )
+    print("%-34s %9s %9s" % ("", "min ms", "median ms"))
+    for name, code in CASES:
+        try:
+            times = [run(code, args.project, env) for _ in range(args.runs)]
+        except subprocess.CalledProcessError:
+            print("%-34s %9s" % (name, "failed"))
+            continue
+        print(
+            "%-34s %9.1f %9.1f"
+            % (name, min(times) * 1000, statistics.median(times) * 1000)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -35,41 +35,38 @@ SOURCE_EPOCH_ZIP = 499162860
 # SCons installs itself in an odd path, under an empty scons/ directory
 prefs = []
 
-try:
-    import SCons.Script
-except ImportError:
-    if "SCons" in sys.modules:
-        del sys.modules["SCons"]  # or it won't try again
+# find SCons without importing it; importing enscons must stay cheap for the
+# PEP 517 backend's metadata fast path
+from importlib.machinery import PathFinder
+
+if "SCons" not in sys.modules and PathFinder.find_spec("SCons") is None:
     try:
         # empty scons directory (lowercase) is also a Python 3 namespace package
         import scons
 
         prefs.extend(scons.__path__)
     except (ImportError, AttributeError):
-        # python 2 / pkg_resources method
+        # ask the installed distribution; pkg_resources would scan every
+        # distribution on sys.path first
         try:
-            import pkg_resources
+            from importlib.metadata import distribution, PackageNotFoundError
         except ImportError:
             pass
         else:
             try:
-                d = pkg_resources.get_distribution("scons")
-            except pkg_resources.DistributionNotFound:
+                d = distribution("scons")
+            except PackageNotFoundError:
                 pass
             else:
-                prefs.append(os.path.join(d.location, "scons"))
-
-sys.path = prefs + sys.path
+                prefs.append(str(d.locate_file("scons")))
 
-import SCons.Script
+if prefs:
+    sys.path[0:0] = prefs
 
-from SCons.Script import Copy, Action, FindInstalledFiles, GetOption, AddOption
-
-from .util import safe_name, to_filename, generate_requirements
+from .metadata import model as _metadata_model, normalize_package, write_wheel
 
 import codecs
 import os.path
-import SCons.Node.FS
 
 
 def get_binary_tag():
@@ -106,11 +103,6 @@ def get_abi3_tag():
         return get_binary_tag()
 
 
-def normalize_package(name):
-    # XXX encourage project names to start out 'safe'
-    return to_filename(safe_name(name))
-
-
 def egg_info_targets(env):
     """
     Write the minimum .egg-info for pip. Full metadata will go into wheel's .dist-info
@@ -134,226 +126,53 @@ def develop(env, target=None, source=None):
     enscons.setup.develop(env["EGG_INFO_PREFIX"] or ".")
 
 
+def package_metadata(env):
+    """
+    Return the enscons.metadata.Metadata for env's PACKAGE_METADATA, parsed
+    once for all of METADATA, PKG-INFO and .egg-info.
+    """
+    return _metadata_model(env["PACKAGE_METADATA"])
+
+
+def _write_text(target, writer):
+    with codecs.open(target.get_path(), mode="w", encoding="utf-8") as f:
+        writer(f)
+
+
 def requires_txt_builder(target, source, env):
     """
     Build requires.txt from PACKAGE_METADATA variable.
     """
-    metadata = env["PACKAGE_METADATA"]
-    full_requires = {}
-    full_requires.update(metadata.get("extras_require", {}))
-    full_requires.update(metadata.get("optional-dependencies", {}))
-    # install_requires is equivalent to extras_require[""][...]
-    if "install_requires" in metadata:
-        full_requires[""] = metadata["install_requires"]
-    if "dependencies" in metadata:
-        full_requires[""] = metadata["dependencies"]
-    with codecs.open(target[0].get_path(), mode="w", encoding="utf-8") as f:
-        for group, dependencies in sorted(full_requires.items()):
-            if group:
-                f.write("\n[%s]\n" % group)
-            for dep in dependencies:
-                f.write("%s\n" % dep)
+    _write_text(target[0], package_metadata(env).write_requires_txt)
 
 
 def entry_points_builder(target, source, env):
     """
     Build entry_points.txt from PACKAGE_METADATA variable.
     """
-    metadata = env["PACKAGE_METADATA"]
-    entry_points = {}
-    if "entry_points" in metadata:
-        entry_points.update(metadata["entry_points"])
-    if "scripts" in metadata:
-        entry_points["console_scripts"] = metadata["scripts"]
-    if "gui-scripts" in metadata:
-        entry_points["gui_scripts"] = metadata["gui-scripts"]
-    with codecs.open(target[0].get_path(), mode="w", encoding="utf-8") as f:
-        for group, items in sorted(entry_points.items()):
-            f.write("[%s]\n" % group)
-            if isinstance(items, list):
-                # Non-PEP 621 extension: entry_point tables as lists of strings
-                for item in items:
-                    f.write("%s\n" % item)
-            else:
-                for key, value in sorted(items.items()):
-                    f.write("%s = %s\n" % (key, value))
+    _write_text(target[0], package_metadata(env).write_entry_points)
 
 
 def egg_info_builder(target, source, env):
     """
     Minimum egg_info. To be used only by pip to get dependencies.
     """
+    writers = {
+        "PKG-INFO": package_metadata(env).write_pkg_info,
+        "requires.txt": package_metadata(env).write_requires_txt,
+        "entry_points.txt": package_metadata(env).write_entry_points,
+    }
     for dnode in env.arg2nodes(target):
-        if dnode.name == "PKG-INFO":
-            with open(dnode.get_path(), "w") as f:
-                f.write("Metadata-Version: 1.1\n")
-                f.write("Name: %s\n" % env["PACKAGE_NAME"])
-                f.write("Version: %s\n" % env["PACKAGE_VERSION"])
-        elif dnode.name == "requires.txt":
-            requires_txt_builder([dnode], source, env)
-        elif dnode.name == "entry_points.txt":
-            entry_points_builder([dnode], source, env)
-
-
-try:
-    basestring
-except NameError:
-    basestring = str
-
-
-def _is_string(obj):
-    # Python 2 compatibility.
-    return isinstance(obj, basestring)
-
-
-def _read_file(filename, encoding="utf-8"):
-    with codecs.open(filename, mode="r", encoding=encoding) as f:
-        return f.read()
-
-
-def _write_header(f, name, value):
-    lines = value.splitlines() or [""]
-    f.write("%s: %s\n" % (name, lines[0]))
-    for line in lines[1:]:
-        f.write("  %s\n" % line)
-
-
-def _write_contacts(f, header_name, header_email, contacts):
-    if len(contacts) == 1:
-        if "name" in contacts[0]:
-            _write_header(f, header_name, contacts[0]["name"])
-        if "email" in contacts[0]:
-            _write_header(f, header_email, contacts[0]["email"])
-    else:
-        value = ", ".join(
-            contact["email"]
-            if "name" not in contact
-            else contact["name"]
-            if "email" not in contact
-            else "%(name)s <%(email)s>" % contact
-            for contact in contacts
-        )
-        emails = any("email" in contact for contact in contacts)
-        _write_header(f, header_email if emails else header_name, value)
+        if dnode.name in writers:
+            _write_text(dnode, writers[dnode.name])
 
 
 def metadata_source(env):
-    metadata = env["PACKAGE_METADATA"]
-    source = ["pyproject.toml"]
-    # The logic here duplicates parts of metadata_builder().
-    # Maybe the two should be unified.
-    if "license" in metadata:
-        if not _is_string(metadata["license"]):
-            if "text" not in metadata["license"]:
-                source.append(metadata["license"]["file"])
-    if "readme" in metadata:
-        if _is_string(metadata["readme"]):
-            source.append(metadata["readme"])
-        else:
-            if "file" in metadata["readme"]:
-                source.append(metadata["readme"]["file"])
-    elif "description_file" in metadata:
-        source.append(metadata["description_file"])
-    return source
+    return package_metadata(env).source()
 
 
 def metadata_builder(target, source, env):
-    metadata = env["PACKAGE_METADATA"]
-    with codecs.open(target[0].get_path(), mode="w", encoding="utf-8") as f:
-        f.write("Metadata-Version: 2.1\n")
-        # Key meanings in accordance with PEP 621, with minor
-        # extensions for backward compatibility. The "dynamic"
-        # key is not implemented.
-        f.write("Name: %s\n" % metadata["name"])
-        f.write("Version: %s\n" % metadata["version"])
-        if "description" in metadata:
-            _write_header(f, "Summary", metadata["description"])
-        if "requires-python" in metadata:
-            _write_header(f, "Requires-Python", metadata["requires-python"])
-        if "license" in metadata:
-            _write_header(
-                f,
-                "License",
-                metadata["license"]
-                if _is_string(metadata["license"])
-                else metadata["license"]["text"]
-                if "text" in metadata["license"]
-                else _read_file(metadata["license"]["file"]),
-            )
-        if "authors" in metadata:
-            _write_contacts(f, "Author", "Author-email", metadata["authors"])
-        else:
-            # Non-PEP 621 keys.
-            if "author" in metadata:
-                _write_header(f, "Author", metadata["author"])
-            if "author_email" in metadata:
-                _write_header(f, "Author-email", metadata["author_email"])
-        if "maintainers" in metadata:
-            _write_contacts(
-                f, "Maintainer", "Maintainer-email", metadata["maintainers"]
-            )
-        if "keywords" in metadata:
-            _write_header(
-                f,
-                "Keywords",
-                metadata["keywords"]
-                if _is_string(metadata["keywords"])
-                else ",".join(metadata["keywords"]),
-            )
-        for classifier in metadata.get("classifiers", []):
-            _write_header(f, "Classifier", classifier)
-        if "url" in metadata:
-            # This is not present in PEP 621.
-            _write_header(f, "Home-Page", metadata["url"])
-        for label, url in metadata.get("urls", {}).items():
-            _write_header(f, "Project-URL", "%s, %s" % (label, url))
-        if "platform" in metadata:
-            # Backward compatibility only.
-            _write_header(f, "Platform", metadata["platform"])
-        full_requires = {}
-        full_requires.update(metadata.get("extras_require", {}))
-        full_requires.update(metadata.get("optional-dependencies", {}))
-        # install_requires is equivalent to extras_require[""][...]
-        if "install_requires" in metadata:
-            full_requires[""] = metadata["install_requires"]
-        if "dependencies" in metadata:
-            full_requires[""] = metadata["dependencies"]
-        for requirement in generate_requirements(full_requires):
-            f.write("%s: %s\n" % requirement)
-        if "readme" in metadata:
-            if _is_string(metadata["readme"]):
-                filename = metadata["readme"]
-                contenttype = None
-                content = _read_file(filename)
-            else:
-                if "file" in metadata["readme"]:
-                    filename = metadata["readme"]["file"]
-                    contenttype = metadata["readme"].get("content-type", None)
-                    encoding = metadata["readme"].get("encoding", "utf-8")
-                    content = _read_file(filename, encoding=encoding)
-                else:
-                    filename = None
-                    contenttype = metadata["readme"].get("content-type", None)
-                    content = metadata["readme"]["text"]
-            if contenttype is None and filename:
-                lowername = filename.lower()
-                contenttype = (
-                    "text/x-rst"
-                    if lowername.endswith(".rst")
-                    else "text/markdown"
-                    if lowername.endswith(".md")
-                    else "text/plain"
-                    if lowername.endswith(".txt")
-                    else None
-                )
-            if contenttype:
-                _write_header(f, "Description-Content-Type", contenttype)
-            f.write("\n\n")
-            f.write(content)
-        elif "description_file" in metadata:
-            # Backward compatibility.
-            f.write("\n\n")
-            f.write(_read_file(metadata["description_file"]))
+    _write_text(target[0], package_metadata(env).write_metadata)
 
 
 import base64
@@ -364,13 +183,11 @@ def urlsafe_b64encode(data):
     return base64.urlsafe_b64encode(data).rstrip(b"=")
 
 
-def add_editable(target, source, env):
+def editable_files(env):
     """
-    Add the editable stub modules to a zip file.
+    Return (arcname, data) pairs for the editable stub modules.
     """
-    import zipfile
     import editables
-    import os.path
 
     project_name = env["PACKAGE_METADATA"].get("name")
     src_root = os.path.abspath(env["PACKAGE_METADATA"].get("src_root", ""))
@@ -378,30 +195,36 @@ def add_editable(target, source, env):
     project = editables.EditableProject(project_name, src_root)
     project.add_to_path(src_root)
 
-    archive = zipfile.ZipFile(
-        target[0].get_path(), "a", compression=zipfile.ZIP_DEFLATED
-    )
-    for f, data in project.files():
-        archive.writestr(zipfile.ZipInfo(f, time.gmtime(SOURCE_EPOCH_ZIP)[:6]), data)
-    archive.close()
+    return list(project.files())
 
 
 def add_manifest(target, source, env):
     """
-    Add the wheel manifest.
+    Add the wheel manifest to an existing zip file.
+
+    env.WheelZip() writes RECORD as it goes; this is for archives built some
+    other way. Members are hashed in chunks, so memory use does not grow
+    with member size.
     """
     import hashlib
     import zipfile
+    from .wheelfile import CHUNK_SIZE
 
     archive = zipfile.ZipFile(
         target[0].get_path(), "a", compression=zipfile.ZIP_DEFLATED
     )
     lines = []
     for f in archive.namelist():
-        data = archive.read(f)
-        size = len(data)
-        digest = hashlib.sha256(data).digest()
-        digest = "sha256=" + (urlsafe_b64encode(digest).decode("ascii"))
+        digest = hashlib.sha256()
+        size = 0
+        with archive.open(f) as member:
+            while True:
+                chunk = member.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+        digest = "sha256=" + (urlsafe_b64encode(digest.digest()).decode("ascii"))
         lines.append("%s,%s,%s" % (f.replace(",", ",,"), digest, size))
 
     record_path = env["DIST_INFO_PATH"].get_path(dir=env["WHEEL_PATH"]) + "/RECORD"
@@ -414,15 +237,8 @@ def add_manifest(target, source, env):
 
 
 def wheelmeta_builder(target, source, env):
-    with open(target[0].get_path(), "w") as f:
-        f.write(
-            """Wheel-Version: 1.0
-Generator: enscons (0.0.1)
-Root-Is-Purelib: %s
-Tag: %s
-"""
-            % (str(env["ROOT_IS_PURELIB"]).lower(), env["WHEEL_TAG"])
-        )
+    with codecs.open(target[0].get_path(), mode="w", encoding="utf-8") as f:
+        write_wheel(f, env["ROOT_IS_PURELIB"], env["WHEEL_TAG"])
 
 
 def wheel_metadata(env):
@@ -445,6 +261,8 @@ def init_wheel(env):
     """
     Create a wheel and its metadata using Environment env.
     """
+    from SCons.Script import Copy
+
     env["PACKAGE_NAMEVER"] = "-".join(
         (env["PACKAGE_NAME_SAFE"], env["PACKAGE_VERSION"])
     )
@@ -463,29 +281,35 @@ def init_wheel(env):
         env["PACKAGE_NAME_SAFE"] + "-" + env["PACKAGE_VERSION"] + ".data"
     )
 
-    # used by prepare_metadata_for_build_wheel
-    dist_info = env.Install(env.Dir(env["WHEEL_DIR"]), env["DIST_INFO_PATH"])
-    env.Alias("dist_info", dist_info)
-
     env["WHEEL_FILE"] = env.Dir(wheel_target_dir).File(wheel_filename)
+    # {arcname: source path} of members Whl() does not stage
+    env["WHEEL_MEMBERS"] = {}
 
     # Write WHEEL and METADATA
     targets = wheel_metadata(env)
 
+    if env.get("WHEEL_VARIANT"):
+        # dist_info and editable come from the primary wheel
+        return targets
+
+    # used by prepare_metadata_for_build_wheel
+    dist_info = env.Install(env.Dir(env["WHEEL_DIR"]), env["DIST_INFO_PATH"])
+    env.Alias("dist_info", dist_info)
+
     # experimental PEP517-style editable
     # with filename that won't collide with our real wheel (SCons wouldn't like that)
     editable_filename = (
         "-".join((env["PACKAGE_NAMEVER"], "ed." + env["WHEEL_TAG"])) + ".whl"
     )
-    editable = env.Zip(
+    # members, editable stubs and RECORD are written in one pass
+    editable = env.WheelZip(
         target=env.Dir(env["WHEEL_DIR"]).File(editable_filename),
         source=env["DIST_INFO_PATH"],
-        ZIPROOT=env["WHEEL_PATH"],
+        WHEEL_EDITABLE=True,
     )
     env.Alias("editable", editable)
     env.NoClean(editable)
-    env.AddPostAction(editable, Action(add_editable))
-    env.AddPostAction(editable, Action(add_manifest))
+    env.Precious(editable)  # WHEEL_INCREMENTAL reads the previous build
 
     editable_dist_info = env.Dir("#build/editable/${PACKAGE_NAMEVER}.dist-info")
     # editable may need an extra dependency, so it gets its own dist-info directory.
@@ -500,7 +324,9 @@ def init_wheel(env):
 
 def Whl(env, category, source, root=None):
     """
-    Copy wheel members into their archive locations.
+    Copy wheel members into their archive locations, or with WHEEL_STAGING
+    False, record their archive names in WHEEL_MEMBERS and return the
+    sources themselves for WhlFile to archive.
     category: 'purelib', 'platlib', 'headers', 'data' etc.
     source: files belonging to category
     root: relative to root directory i.e. '.', 'src'
@@ -523,34 +349,16 @@ def Whl(env, category, source, root=None):
     for node in env.arg2nodes(source):
         relpath = os.path.relpath(node.get_path(), root or "")
         args = (os.path.join(target_dir, relpath), node)
-        targets.append(env.InstallAs(*args))
+        if env.get("WHEEL_STAGING", True):
+            targets.append(env.InstallAs(*args))
+        else:
+            arcname = os.path.relpath(args[0], env["WHEEL_PATH"].get_path())
+            env["WHEEL_MEMBERS"][arcname] = node.get_path()
+            targets.append(node)
 
     return targets + wheelmeta
 
 
-def _patch_source_epoch():
-    """
-    SCons ZIP doesn't accept this as a parameter yet.
-    """
-    if hasattr(_patch_source_epoch, "_once"):
-        return
-    _patch_source_epoch._once = True
-
-    import zipfile
-
-    try:
-        _from_file = zipfile.ZipInfo.from_file
-    except AttributeError:  # Python 2?
-        return
-
-    def from_file(filename, arcname=None, **kwargs):
-        zinfo = _from_file(filename, arcname, **kwargs)
-        zinfo.date_time = time.gmtime(SOURCE_EPOCH_ZIP)[0:6]
-        return zinfo
-
-    zipfile.ZipInfo.from_file = from_file
-
-
 def WhlFile(env, target=None, source=None):
     """
     Archive wheel members collected from Whl(...)
@@ -562,20 +370,42 @@ def WhlFile(env, target=None, source=None):
         source = target
         target = None
 
-    _patch_source_epoch()
-
-    whl = env.Zip(
-        target=target or env.get("WHEEL_FILE"), source=source, ZIPROOT=env["WHEEL_PATH"]
-    )
+    # RECORD is written while the members are compressed
+    whl = env.WheelZip(target=target or env.get("WHEEL_FILE"), source=source)
 
     env.NoClean(whl)
-    env.Alias("bdist_wheel", whl)
-    env.AddPostAction(whl, Action(add_manifest))
+    env.Precious(whl)  # WHEEL_INCREMENTAL reads the previous build
+    if not env.get("WHEEL_VARIANT"):
+        env.Alias("bdist_wheel", whl)
+    env.Alias("wheels", whl)
     env.Clean(whl, env["WHEEL_PATH"])
 
     return whl
 
 
+def WheelVariant(env, tag, **kw):
+    """
+    Return a clone of env that builds another wheel, tagged tag, from the
+    same sources. Its members are staged in their own WHEEL_PATH,
+    "#build/wheel-<tag>/" by default, with their own .dist-info.
+
+    Variants are built by the "wheels" target along with the primary wheel;
+    "bdist_wheel", "dist_info" and "editable" refer to the primary wheel.
+    """
+    enscons_defaults(env)
+
+    variant = env.Clone(WHEEL_TAG=tag, WHEEL_VARIANT=True, **kw)
+    # Whl() sets these up again for the variant
+    for key in ("WHEEL_FILE", "WHEEL_PATH", "WHEEL_MEMBERS"):
+        if key in variant and key not in kw:
+            del variant[key]
+    if "WHEEL_PATH" not in kw:
+        variant["WHEEL_PATH"] = env.Dir("#build/wheel-" + tag)
+    if "ROOT_IS_PURELIB" not in kw:
+        variant["ROOT_IS_PURELIB"] = tag.endswith("none-any")
+    return variant
+
+
 def SDist(env, target=None, source=None):
     """
     Call env.Package() with sdist filename inferred from
@@ -613,6 +443,8 @@ def enscons_defaults(env):
     """
     To avoid setting these in generate().
     """
+    from SCons.Script import GetOption
+
     once_key = "_ENSCONS_DEFAULTS"
     if once_key in env:
         return
@@ -652,7 +484,22 @@ def generate(env):
 
     pytar.generate(env)
 
-    if not hasattr(generate, "once"):
+    # wheel archiver
+    from . import wheelfile
+
+    wheelfile.generate(env)
+
+    # share job slots with make
+    from . import jobserver
+
+    jobserver.generate(env)
+
+    import SCons.Script
+    from SCons.Script import AddOption
+
+    # once per option parser; the PEP 517 backend may read SConstruct again
+    parser = SCons.Script.Main.OptionsParser
+    if getattr(generate, "once", None) is not parser:
         AddOption(
             "--egg-base",
             dest="egg_base",
@@ -683,10 +530,29 @@ def generate(env):
             help="sdist target directory",
         )
 
-        generate.once = True
+        AddOption(
+            "--cache-dir",
+            dest="cache_dir",
+            type="string",
+            nargs=1,
+            action="store",
+            metavar="DIR",
+            help="SCons CacheDir and wheel member cache under DIR",
+        )
+
+        generate.once = parser
+
+    cache_dir = SCons.Script.GetOption("cache_dir")
+    if cache_dir:
+        cache_dir = os.path.expanduser(cache_dir)  # --cache-dir=~/...
+        if not os.path.isdir(cache_dir):  # CacheDir only creates the last part
+            os.makedirs(cache_dir)
+        env.CacheDir(os.path.join(cache_dir, "scons"))
+        env["WHEEL_CACHE_DIR"] = os.path.join(cache_dir, "wheel")
 
     env.AddMethod(Whl)
     env.AddMethod(WhlFile)
+    env.AddMethod(WheelVariant)
     env.AddMethod(SDist)
 
 
@@ -1,14 +1,17 @@
 """
 PEP 517 interface to enscons.
 
-To be invoked by a future version of pip.
-
-May not be possible to invoke more than one function without reloading Python.
+prepare_metadata_for_build_wheel() renders the .dist-info without importing
+SCons when pyproject.toml declares the wheel tag; see enscons.metadata.
+Other hooks build with a warm SCons session kept between calls; see
+enscons.session.
 """
 
 import os.path
-import sys
-import SCons.Script.Main
+
+from . import metadata, toml
+
+_session = None
 
 
 # optional hooks
@@ -20,33 +23,91 @@ import SCons.Script.Main
 #     return []
 
 
-def _run(alias):
-    try:
-        SCons.Script.Main.main()
-    except SystemExit as e:
-        if e.code != 0:
-            raise
-    # extreme non-api:
-    lookup = SCons.Node.arg2nodes_lookups[0](alias).sources[0]
-    return os.path.basename(str(lookup))
+def _setting(config_settings, key):
+    value = (config_settings or {}).get(key)
+    if isinstance(value, list):  # repeated on the frontend's command line
+        value = value[-1]
+    return value
+
+
+def _arguments(config_settings):
+    """
+    Map config_settings onto SCons command line arguments. Return arguments
+    for reading SConstruct, arguments for each build, and a profile path.
+
+    jobs=N|auto     -j; auto is the CPUs allowed by affinity and cgroup quota
+    cache-dir=DIR   SCons CacheDir and WHEEL_CACHE_DIR under DIR
+    profile=FILE    cProfile statistics for the build
+    """
+    read_args = []
+    build_args = []
+    jobs = _setting(config_settings, "jobs")
+    if jobs:
+        if jobs == "auto":
+            from .util import cpu_count
+
+            jobs = cpu_count()
+        build_args.append("--jobs=%d" % int(jobs))
+    cache_dir = _setting(config_settings, "cache-dir")
+    if cache_dir:
+        # "-C cache-dir=~/..." reaches us unexpanded
+        cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        read_args.append("--cache-dir=" + cache_dir)
+    profile = _setting(config_settings, "profile")
+    if profile:
+        profile = os.path.abspath(os.path.expanduser(profile))
+    return read_args, build_args, profile
+
+
+def _run(alias, directory, config_settings=None, metadata_directory=None):
+    global _session
+    import shutil
+
+    read_args, build_args, profile = _arguments(config_settings)
+    if _session is not None and not _session.current(read_args):
+        _session.reset()
+        _session = None
+    # imported after reset(), which unloads them
+    from . import session, wheelfile
+
+    if _session is None:
+        _session = session.Session(read_args)
+        _session.read()
+    path = _session.build(alias, build_args, profile)
+    name = os.path.basename(path)
+    if metadata_directory is not None:
+        # the wheel's metadata must be what prepare_metadata_for_build_wheel
+        # returned. This only validates: the build renders the wheel's own
+        # metadata either way, and the prepared files are compared by RECORD
+        # digest, not copied in.
+        dist_info = "-".join(name.split("-")[:2]) + ".dist-info"
+        wheelfile.check_dist_info(path, os.path.join(metadata_directory, dist_info))
+    dest = os.path.join(directory, name)
+    if os.path.abspath(path) != os.path.abspath(dest):
+        os.makedirs(directory, exist_ok=True)
+        if os.path.isdir(path):
+            shutil.copytree(path, dest, dirs_exist_ok=True)
+        else:
+            shutil.copyfile(path, dest)
+    return name
 
 
 def prepare_metadata_for_build_wheel(metadata_directory, config_settings=None):
-    sys.argv[1:] = ["--wheel-dir=" + metadata_directory, "dist_info"]
-    return _run("dist_info")
+    with open("pyproject.toml", "rb") as f:
+        static = metadata.static_wheel(toml.load(f))
+    if static is not None:
+        return metadata.write_dist_info(metadata_directory, *static)
+    return _run("dist_info", metadata_directory, config_settings)
 
 
 def build_wheel(wheel_directory, config_settings=None, metadata_directory=None):
-    sys.argv[1:] = ["--wheel-dir=" + wheel_directory, "bdist_wheel"]
-    return _run("bdist_wheel")
+    return _run("bdist_wheel", wheel_directory, config_settings, metadata_directory)
 
 
 def build_sdist(sdist_directory, config_settings=None):
-    sys.argv[1:] = ["--dist-dir=" + sdist_directory, "sdist"]
-    return _run("sdist")
+    return _run("sdist", sdist_directory, config_settings)
 
 
 # PEP 660 editable installation
 def build_editable(wheel_directory, config_settings=None, metadata_directory=None):
-    sys.argv[1:] = ["--wheel-dir=" + wheel_directory, "editable"]
-    return _run("editable")
+    return _run("editable", wheel_directory, config_settings, metadata_directory)
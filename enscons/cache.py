@@ -0,0 +1,104 @@
+"""
+Content-addressed file cache shared by enscons builders.
+
+Entries are files named by key under a cache directory. Reading an entry
+touches its mtime, which serves as the clock for least-recently-used
+eviction once the directory grows past its size limit. Entries are written
+to a temporary file and renamed into place, so concurrent builds sharing a
+cache never see partial entries.
+"""
+
+import contextlib
+import os
+import tempfile
+
+DEFAULT_CACHE_SIZE = 1 << 30
+
+
+class Cache(object):
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+
+    def _entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """
+        Return the path to the entry for key, or None. Marks it as used.
+        """
+        path = self._entry(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def read(self, key):
+        """
+        Return the contents of the entry for key, or None.
+        """
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:  # evicted by another build
+            return None
+
+    @contextlib.contextmanager
+    def writer(self, key):
+        """
+        Context manager yielding a file object; its contents become the
+        entry for key if the block succeeds.
+        """
+        path = self._entry(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def write(self, key, data):
+        with self.writer(key) as f:
+            f.write(data)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_size.
+        """
+        entries = []
+        total = 0
+        try:
+            subdirs = list(os.scandir(self.path))
+        except OSError:
+            return
+        for subdir in subdirs:
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_size:
+                break
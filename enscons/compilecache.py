@@ -0,0 +1,352 @@
+"""
+Compile cache for C and C++ extensions.
+
+Set COMPILE_CACHE when creating an Environment with enscons.cpyext, or call
+generate() after setting it:
+
+    env = Environment(tools=["default", cpyext.generate], COMPILE_CACHE="auto")
+
+"ccache" or "sccache" run compiles through that launcher. "builtin" keeps
+objects in an enscons.cache.Cache under COMPILE_CACHE_DIR, keyed by the
+preprocessed source, the command line, and the compiler executable, like
+ccache's preprocessor mode. "auto" picks ccache, then sccache, then the
+builtin cache. Only gcc-style compiles by $CC or $CXX of one source with -c
+and -o are cached; other commands run unchanged, through the SPAWN the cache
+wraps. Hits and misses are printed when the build exits.
+"""
+
+import atexit
+import hashlib
+import os
+import shlex
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+
+from . import jobserver
+from .cache import Cache, DEFAULT_CACHE_SIZE
+
+# bump when the key or the entry format changes
+CACHE_VERSION = b"enscons-compilecache-1"
+
+SOURCE_SUFFIXES = (".c", ".cc", ".cpp", ".cxx", ".c++", ".C", ".m", ".mm")
+
+# flags that make the compiler read or write files the key does not cover
+UNCACHEABLE_PREFIXES = (
+    "-M",
+    "-Wp,-M",
+    "--coverage",
+    "-ftest-coverage",
+    "-fprofile-",
+    "-fauto-profile",
+    "-save-temps",
+    "@",
+)
+
+LAUNCHERS = ("ccache", "sccache")
+
+# construction variables naming the compilers whose commands are cached
+COMPILER_VARIABLES = ("CC", "CXX", "SHCC", "SHCXX")
+
+
+class Stats(object):
+    """
+    Compiles seen by one cache, printed at exit.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.compiles = 0
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self._lock = threading.Lock()
+
+    def count(self, result):
+        with self._lock:
+            setattr(self, result, getattr(self, result) + 1)
+
+    def report(self):
+        if self.hits or self.misses or self.uncacheable:
+            print(
+                "compile cache (%s): %d hits, %d misses, %d uncacheable"
+                % (self.name, self.hits, self.misses, self.uncacheable)
+            )
+        elif self.compiles:  # a launcher that doesn't say
+            print("compile cache (%s): %d compiles" % (self.name, self.compiles))
+
+
+def compilers(env):
+    """
+    Return the commands of env's C and C++ compilers.
+    """
+    names = set()
+    for name in COMPILER_VARIABLES:
+        words = env.subst_list("$" + name)[0]
+        if words:
+            names.add(str(words[0]))
+    return names
+
+
+def split_command(args, compilers):
+    """
+    Return a compile command's arguments as passed to SPAWN, already escaped,
+    as a list, or None for other commands: those not run by one of compilers,
+    or not compiling exactly one source with -c and -o.
+    """
+    if os.name != "posix":
+        return None
+    try:
+        argv = shlex.split(" ".join(args))
+    except ValueError:
+        return None
+    if not argv or argv[0] not in compilers or "-c" not in argv:
+        return None
+    if argv.count("-o") != 1 or argv[-1] == "-o":
+        return None
+    sources = [arg for arg in argv[1:] if arg.endswith(SOURCE_SUFFIXES)]
+    if len(sources) != 1:
+        return None
+    return argv
+
+
+def cacheable_output(argv):
+    """
+    Return the output of compile command argv, or None if its flags make
+    the compiler read or write files the key does not describe.
+    """
+    if any(arg.startswith(UNCACHEABLE_PREFIXES) for arg in argv[1:]):
+        return None
+    return argv[argv.index("-o") + 1]
+
+
+def _spawn_output(spawn, sh, escape, args, env, stream):
+    """
+    Run args through spawn, returning the exit status and what the command
+    wrote to file descriptor stream, captured with a shell redirection.
+    """
+    fd, path = tempfile.mkstemp(prefix="enscons-compile-")
+    os.close(fd)
+    try:
+        status = spawn(
+            sh, escape, args[0], list(args) + ["%d>%s" % (stream, escape(path))], env
+        )
+        with open(path, "rb") as f:
+            return status, f.read()
+    finally:
+        os.unlink(path)
+
+
+def _compiler_identity(compiler, env):
+    path = shutil.which(compiler, path=env.get("PATH")) or compiler
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return "%s\0%d\0%d" % (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+
+class BuiltinCache(object):
+    """
+    Content-addressed object cache for gcc-style compilers.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        self.cache = Cache(path, max_size)
+        self.stats = Stats("builtin " + self.cache.path)
+
+    def key(self, argv, spawn, sh, escape, env):
+        """
+        Return the cache key for compiling argv, or None if the source does
+        not preprocess. The preprocessor runs through spawn.
+        """
+        identity = _compiler_identity(argv[0], env)
+        if identity is None:
+            return None
+        output_index = argv.index("-o") + 1
+        preprocess = [
+            escape("-E" if arg == "-c" else arg)
+            for i, arg in enumerate(argv)
+            if i not in (output_index - 1, output_index)
+        ]
+        status, preprocessed = _spawn_output(
+            spawn, sh, escape, preprocess + ["2>/dev/null"], env, 1
+        )
+        if status != 0:
+            return None  # let the compiler report the error
+        h = hashlib.sha256(CACHE_VERSION)
+        h.update(identity.encode("utf-8"))
+        command = argv[:output_index] + argv[output_index + 1 :]
+        h.update("\0".join(command).encode("utf-8"))
+        if any(arg.startswith("-g") and arg != "-g0" for arg in argv):
+            # debug information names the build directory
+            h.update(os.getcwd().encode("utf-8"))
+        h.update(preprocessed)
+        return h.hexdigest()
+
+    def spawn(self, spawn, sh, escape, cmd, args, env, compilers=()):
+        argv = split_command(args, compilers)
+        if argv is None:
+            return spawn(sh, escape, cmd, args, env)
+        output = cacheable_output(argv)
+        if output is None:
+            self.stats.count("uncacheable")
+            return spawn(sh, escape, cmd, args, env)
+        with jobserver.slot():
+            key = self.key(argv, spawn, sh, escape, env)
+            if key is None:
+                self.stats.count("uncacheable")
+                return spawn(sh, escape, cmd, args, env)
+            entry = self.cache.read(key)
+            if entry is not None:
+                self.stats.count("hits")
+                self._restore(entry, output)
+                return 0
+            self.stats.count("misses")
+            status, stderr = _spawn_output(spawn, sh, escape, args, env, 2)
+        sys.stderr.write(stderr.decode("utf-8", "replace"))
+        if status == 0:
+            try:
+                with open(output, "rb") as f:
+                    obj = f.read()
+                with self.cache.writer(key) as f:
+                    f.write(struct.pack("<I", len(stderr)))
+                    f.write(stderr)
+                    f.write(obj)
+            except OSError:  # full or read-only cache; the object is built
+                pass
+        return status
+
+    def _restore(self, entry, output):
+        (stderr_size,) = struct.unpack("<I", entry[:4])
+        sys.stderr.write(entry[4 : 4 + stderr_size].decode("utf-8", "replace"))
+        directory = os.path.dirname(output) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(entry[4 + stderr_size :])
+            os.replace(tmp, output)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def close(self):
+        self.stats.report()
+        self.cache.evict()
+
+
+class Launcher(object):
+    """
+    Run compiles through ccache or sccache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.stats = Stats(self.name)
+        self.statslog = None
+        if self.name.startswith("ccache"):
+            # ccache 4.4+ appends each compile's result here
+            fd, self.statslog = tempfile.mkstemp(prefix="enscons-ccache-")
+            os.close(fd)
+
+    def spawn(self, spawn, sh, escape, cmd, args, env, compilers=()):
+        if split_command(args, compilers) is None:
+            return spawn(sh, escape, cmd, args, env)
+        self.stats.count("compiles")
+        if self.statslog:
+            env = dict(env, CCACHE_STATSLOG=self.statslog)
+        return spawn(sh, escape, cmd, [escape(self.path)] + list(args), env)
+
+    def close(self):
+        if self.statslog:
+            try:
+                with open(self.statslog) as f:
+                    for line in f:
+                        line = line.strip()
+                        if line.endswith("cache_hit"):
+                            self.stats.hits += 1
+                        elif line == "cache_miss":
+                            self.stats.misses += 1
+            except OSError:
+                pass
+            finally:
+                os.unlink(self.statslog)
+        self.stats.report()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _close_caches():
+    for cache in _caches.values():
+        cache.close()
+
+
+def get_cache(kind, path=None, max_size=DEFAULT_CACHE_SIZE):
+    """
+    Return the process' cache for kind ("auto", "builtin", "ccache" or
+    "sccache", or a launcher path), or None if kind is not available.
+    """
+    if kind == "auto":
+        for launcher in LAUNCHERS:
+            found = shutil.which(launcher)
+            if found:
+                kind = found
+                break
+        else:
+            kind = "builtin"
+    if kind == "builtin":
+        if path is None:
+            from .util import user_cache_dir
+
+            path = os.path.join(user_cache_dir(), "objects")
+        key = ("builtin", os.path.abspath(path))
+    else:
+        kind = shutil.which(kind)
+        if kind is None:
+            return None
+        key = ("launcher", kind)
+    with _caches_lock:
+        if key not in _caches:
+            if not _caches:
+                atexit.register(_close_caches)
+            if key[0] == "builtin":
+                _caches[key] = BuiltinCache(key[1], max_size)
+            else:
+                _caches[key] = Launcher(kind)
+        return _caches[key]
+
+
+def generate(env):
+    """
+    Route env's compiles through the cache chosen by COMPILE_CACHE.
+    """
+    env.SetDefault(COMPILE_CACHE=None, COMPILE_CACHE_DIR=None)
+    env.SetDefault(COMPILE_CACHE_SIZE=DEFAULT_CACHE_SIZE)
+    spawn = env["SPAWN"]
+    # generate() again replaces the cache rather than stacking another
+    spawn = getattr(spawn, "compile_cache_spawn", spawn)
+    kind = env["COMPILE_CACHE"]
+    cache = None
+    if kind:
+        directory = env["COMPILE_CACHE_DIR"]
+        cache = get_cache(
+            kind,
+            directory and str(env.Dir(directory)),
+            env["COMPILE_CACHE_SIZE"],
+        )
+        if cache is None:
+            print("compile cache: %s not found, compiling without it" % kind)
+    if cache is None:
+        env["SPAWN"] = spawn
+        return
+
+    def compile_cache_spawn(sh, escape, cmd, args, spawn_env):
+        return cache.spawn(spawn, sh, escape, cmd, args, spawn_env, compilers(env))
+
+    compile_cache_spawn.compile_cache_spawn = spawn
+    env["SPAWN"] = compile_cache_spawn
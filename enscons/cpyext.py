@@ -1,19 +1,85 @@
 """
 Compiled extension support.
+
+The compiler configuration setuptools would use is found by running a
+build_ext that compiles nothing, which takes a noticeable fraction of a
+second. compiler_config() caches it in the user cache directory (see
+enscons.util.user_cache_dir), keyed by the interpreter, its sysconfig
+variables, setuptools, and the environment variables that customize the
+compiler, and in memory for the rest of the process.
 """
 
 from __future__ import print_function
 
+import hashlib
+import json
+import sys
 import sysconfig
 import os
 import os.path
-
-from setuptools import Distribution
-from setuptools.extension import Extension
-from setuptools.command.build_ext import build_ext
+import tempfile
+import types
 
 import importlib
 import importlib.machinery
+import importlib.util
+
+import SCons.Action
+import SCons.Errors
+import SCons.Util
+
+# setuptools is imported when the compiler configuration is first needed
+no_build_ext = None
+
+# bump when the cached configuration changes shape
+CONFIG_VERSION = 1
+
+# read by distutils' customize_compiler() and the msvc compilers
+CONFIG_ENV_VARS = (
+    "AR",
+    "ARFLAGS",
+    "ARCHFLAGS",
+    "CC",
+    "CCSHARED",
+    "CFLAGS",
+    "CPP",
+    "CPPFLAGS",
+    "CXX",
+    "DISTUTILS_USE_SDK",
+    "LDCXXSHARED",
+    "LDFLAGS",
+    "LDSHARED",
+    "MACOSX_DEPLOYMENT_TARGET",
+    "MSSdk",
+    "SETUPTOOLS_USE_DISTUTILS",
+    "_PYTHON_HOST_PLATFORM",
+    "_PYTHON_SYSCONFIGDATA_NAME",
+)
+
+UNIX_ATTRS = (
+    "compiler",
+    "compiler_cxx",
+    "linker_exe",
+    "linker_so",
+    "include_dirs",
+    "library_dirs",
+    "libraries",
+)
+
+MSVC_ATTRS = (
+    "cc",
+    "compile_options",
+    "linker",
+    "ldflags_static",
+    "ldflags_shared",
+    "rc",
+    "include_dirs",
+    "library_dirs",
+    "libraries",
+)
+
+_configs = {}
+_interpreter_digest = None
 
 
 # not used when generate is passed directly to Environment
@@ -31,56 +97,59 @@ def extension_filename(modname, abi3=False):
     If abi3=True and supported by the interpreter, return e.g.
     "a/b/c.abi3.so".
     """
-    # we could probably just split modname by '.' instead of using ext here:
-    ext = get_build_ext()
-    fullname = ext.get_ext_fullname(modname)
-    modpath = fullname.split(".")
-    ext_filename = os.path.join(*modpath)
+    # build_ext.get_ext_fullname() is modname when there is no package
+    ext_filename = os.path.join(*modname.split("."))
 
-    suffix = None
-    try:
-        suffixes = importlib.machinery.EXTENSION_SUFFIXES
-        suffix = suffixes[0] if suffixes else None
-    except AttributeError:
-        pass
-    suffix = sysconfig.get_config_var("EXT_SUFFIX")
+    config = compiler_config()
+    suffix = config.ext_suffix
 
     if abi3:
-        suffix = get_abi3_suffix() or suffix
+        suffix = config.abi3_suffix or suffix
 
     return ext_filename + suffix
 
 
-class no_build_ext(build_ext):
-    output = []  # for testing
+def _no_build_ext():
+    global no_build_ext
+    if no_build_ext is not None:
+        return no_build_ext
+
+    from setuptools.command.build_ext import build_ext
 
-    # Are you kidding me? We have to run build_ext() to finish configuring the compiler.
-    def build_extension(self, ext):
-        def noop_spawn(*args):
-            no_build_ext.output.append(args)
+    class no_build_ext(build_ext):
+        output = []  # for testing
 
-        self.compiler.spawn = noop_spawn
-        build_ext.build_extension(self, ext)
+        # Are you kidding me? We have to run build_ext() to finish configuring the compiler.
+        def build_extension(self, ext):
+            def noop_spawn(*args):
+                no_build_ext.output.append(args)
+
+            self.compiler.spawn = noop_spawn
+            build_ext.build_extension(self, ext)
+
+    return no_build_ext
 
 
 def get_build_ext(name="zoot"):
     """
     Naughty Zoot
     """
-
-    tmp_dir = "/tmp/enscons"
-
-    # from distutils.test.test_build_ext.py :
-    xx_c = os.path.join(tmp_dir, "xxmodule.c")
-    xy_cpp = os.path.join(tmp_dir, "xymodule.cc")
-    xx_ext = Extension("xx", [xx_c, xy_cpp])
-    dist = Distribution({"name": name, "ext_modules": [xx_ext]})
-    dist.package_dir = tmp_dir
-    cmd = no_build_ext(dist)
-    cmd.build_lib = tmp_dir
-    cmd.build_temp = tmp_dir
-    cmd.ensure_finalized()
-    cmd.run()
+    from setuptools import Distribution
+    from setuptools.extension import Extension
+
+    # private, so concurrent builds don't race
+    with tempfile.TemporaryDirectory(prefix="enscons-") as tmp_dir:
+        # from distutils.test.test_build_ext.py :
+        xx_c = os.path.join(tmp_dir, "xxmodule.c")
+        xy_cpp = os.path.join(tmp_dir, "xymodule.cc")
+        xx_ext = Extension("xx", [xx_c, xy_cpp])
+        dist = Distribution({"name": name, "ext_modules": [xx_ext]})
+        dist.package_dir = tmp_dir
+        cmd = _no_build_ext()(dist)
+        cmd.build_lib = tmp_dir
+        cmd.build_temp = tmp_dir
+        cmd.ensure_finalized()
+        cmd.run()
     return cmd
 
 
@@ -94,21 +163,641 @@ def get_abi3_suffix():
             return suffix
 
 
+def _interpreter_key():
+    """
+    Digest of the parts of the configuration key fixed for this process.
+    """
+    global _interpreter_digest
+    if _interpreter_digest is None:
+        setuptools = importlib.util.find_spec("setuptools")
+        try:
+            setuptools_mtime = os.stat(setuptools.origin).st_mtime
+        except (AttributeError, TypeError, OSError):
+            setuptools_mtime = None
+        key = {
+            "version": CONFIG_VERSION,
+            "executable": sys.executable,
+            "sysconfig": sysconfig.get_config_vars(),
+            "setuptools": [setuptools and setuptools.origin, setuptools_mtime],
+        }
+        data = json.dumps(key, sort_keys=True, default=repr).encode("utf-8")
+        _interpreter_digest = hashlib.sha256(data).hexdigest()
+    return _interpreter_digest
+
+
+def _config_key():
+    # SConstruct may set these in os.environ before asking
+    environ = [os.environ.get(var) for var in CONFIG_ENV_VARS]
+    data = json.dumps([_interpreter_key(), environ]).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _probe_config():
+    compiler = get_build_ext().compiler
+    msvc = not hasattr(compiler, "compiler")  # assume Windows
+    config = {
+        attr: getattr(compiler, attr) for attr in (MSVC_ATTRS if msvc else UNIX_ATTRS)
+    }
+    config["msvc"] = msvc
+    config["ext_suffix"] = sysconfig.get_config_var("EXT_SUFFIX")
+    config["abi3_suffix"] = get_abi3_suffix()
+    return config
+
+
+def compiler_config():
+    """
+    Return the compiler configuration setuptools would use for extensions,
+    as attributes named after those of its compiler (UNIX_ATTRS or
+    MSVC_ATTRS), plus msvc, ext_suffix and abi3_suffix.
+    """
+    from .cache import Cache
+    from .util import user_cache_dir
+
+    key = _config_key()
+    if key in _configs:
+        return types.SimpleNamespace(**_configs[key])
+
+    cache = Cache(os.path.join(user_cache_dir(), "cpyext"))
+    config = None
+    data = cache.read(key)
+    if data is not None:
+        try:
+            config = json.loads(data.decode("utf-8"))
+        except ValueError:  # truncated by a full disk; probe again
+            pass
+    if config is None:
+        config = _probe_config()
+        try:
+            cache.write(key, json.dumps(config).encode("utf-8"))
+        except OSError:  # read-only home directory; cache in memory only
+            pass
+    _configs[key] = config
+    return types.SimpleNamespace(**config)
+
+
+# gcc finds X.h.gch, and clang X.h.pch, next to a header named by -include X.h
+PCH_SUFFIXES = {"gcc": ".gch", "clang": ".pch"}
+
+_compiler_kinds = {}
+
+
+def compiler_kind(env):
+    """
+    Return "gcc" or "clang" for env's C compiler, or None.
+    """
+    cc = env.WhereIs(env.subst("$SHCC"))
+    if cc not in _compiler_kinds:
+        import subprocess
+
+        kind = None
+        try:
+            version = subprocess.run(
+                [cc, "--version"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True,
+            ).stdout
+        except (OSError, TypeError):
+            version = ""
+        if "clang" in version:
+            kind = "clang"
+        elif "Free Software Foundation" in version:
+            kind = "gcc"
+        _compiler_kinds[cc] = kind
+    return _compiler_kinds[cc]
+
+
+def _write_pch_header(target, source, env):
+    with open(str(target[0]), "w") as f:
+        f.write(source[0].read())
+
+
+def _pch_emitter(emitter):
+    def pch_emitter(target, source, env):
+        if emitter:
+            target, source = emitter(target, source, env)
+        if env.get("PYTHON_PCH_FILE"):
+            env.Depends(target, env["PYTHON_PCH_FILE"])
+        return target, source
+
+    pch_emitter.pch = True
+    return pch_emitter
+
+
+def PythonPCH(env, headers=("Python.h",)):
+    """
+    Precompile headers, by default Python.h, with env's flags for shared C
+    objects, and include them first in every C extension object env or its
+    later clones build. Return the precompiled header, or None if the
+    compiler is not gcc or clang.
+
+    Macros that must precede Python.h, such as Py_LIMITED_API, belong in
+    CPPDEFINES rather than the source. PY_SSIZE_T_CLEAN is defined.
+    """
+    suffix = PCH_SUFFIXES.get(compiler_kind(env))
+    if suffix is None:
+        return None
+
+    content = "".join(
+        ["/* generated by enscons.cpyext.PythonPCH */\n"]
+        + ["#ifndef PY_SSIZE_T_CLEAN\n#define PY_SSIZE_T_CLEAN\n#endif\n"]
+        + ["#include <%s>\n" % header for header in headers]
+    )
+    # one precompiled header per compiler configuration
+    flags = env.subst("$SHCC $SHCFLAGS $SHCCFLAGS $_CCCOMCOM", raw=1)
+    key = hashlib.sha256((flags + content).encode("utf-8")).hexdigest()[:16]
+    header = env.File("#build/pch/%s/python_pch.h" % key)
+    env.Command(header, env.Value(content), _write_pch_header)
+    env["PYTHON_PCHCOM"] = (
+        "$SHCC -x c-header -o $TARGET -c $SHCFLAGS $SHCCFLAGS $_CCCOMCOM $SOURCE"
+    )
+    pch = env.Command(
+        header.path + suffix,
+        header,
+        "$PYTHON_PCHCOM",
+        _PYTHON_PCH_FLAGS="",
+        PYTHON_PCH_FILE=None,
+    )[0]
+
+    env["PYTHON_PCH_FILE"] = pch
+    env["_PYTHON_PCH_FLAGS"] = ["-include", header]
+    if "$_PYTHON_PCH_FLAGS" not in env["SHCFLAGS"]:
+        env.Append(SHCFLAGS=["$_PYTHON_PCH_FLAGS"])
+    shared_obj = env["BUILDERS"]["SharedObject"]
+    emitter = shared_obj.emitter.get(".c")
+    if not getattr(emitter, "pch", False):
+        shared_obj.emitter[".c"] = _pch_emitter(emitter)
+    return pch
+
+
+def _build_path(node):
+    """
+    Return node's source path relative to the project, to name the files
+    built from it under build/.
+    """
+    path = node.srcnode().get_path()
+    if path.startswith(os.pardir):  # outside the project
+        path = os.path.basename(path)
+    return path
+
+
+# flags added to compiles and links of each stage; $PGO_DATA_DIR receives
+# the training run's profiles and $PGO_PROFILE is the merged profile
+PGO_FLAGS = {
+    "gcc": {
+        "PGO_GENERATE_FLAGS": ["-fprofile-generate"],
+        "PGO_USE_FLAGS": ["-fprofile-use", "-fprofile-correction"],
+        "LTO_FLAGS": ["-flto=auto"],
+    },
+    "clang": {
+        "PGO_GENERATE_FLAGS": ["-fprofile-generate=$PGO_DATA_DIR"],
+        "PGO_USE_FLAGS": ["-fprofile-use=$PGO_PROFILE"],
+        "LTO_FLAGS": ["-flto=thin"],
+    },
+}
+
+PGO_DATA_SUFFIXES = {"gcc": ".gcda", "clang": ".profraw"}
+
+# load the instrumented module under its own name, then run the training
+# script as __main__; the package around it comes from the source tree
+PGO_BOOTSTRAP = """\
+import importlib, importlib.util, runpy, sys, types
+name, path, root, script = sys.argv[1:5]
+sys.path.insert(0, root)
+spec = importlib.util.spec_from_file_location(name, path)
+module = importlib.util.module_from_spec(spec)
+sys.modules[name] = module
+spec.loader.exec_module(module)
+# parent packages from root, or empty ones if they are not there
+parts = name.split(".")
+for i in range(1, len(parts)):
+    parent = ".".join(parts[:i])
+    try:
+        importlib.import_module(parent)
+    except ImportError:
+        package = types.ModuleType(parent)
+        package.__path__ = []
+        sys.modules[parent] = package
+for i in range(1, len(parts)):
+    child = sys.modules[".".join(parts[: i + 1])]
+    setattr(sys.modules[".".join(parts[:i])], parts[i], child)
+sys.argv = sys.argv[4:]
+runpy.run_path(script, run_name="__main__")
+"""
+
+
+def _pgo_data(directory, suffix):
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(suffix):
+                yield os.path.join(dirpath, filename)
+
+
+def _pgo_train(target, source, env):
+    """
+    Run the training script against the instrumented module and gather the
+    profile for the optimized build.
+    """
+    import subprocess
+
+    kind = env["PGO_COMPILER"]
+    data_dir = env.Dir(env["PGO_DATA_DIR"]).get_abspath()
+    # counts add up across runs
+    for path in _pgo_data(data_dir, PGO_DATA_SUFFIXES[kind]):
+        os.unlink(path)
+
+    command = [
+        sys.executable,
+        "-c",
+        PGO_BOOTSTRAP,
+        env["PGO_MODULE"],
+        source[0].get_abspath(),
+        env.Dir(env["PGO_SOURCE_ROOT"]).get_abspath(),
+        source[1].get_abspath(),
+    ] + [env.subst(str(arg)) for arg in env["PGO_TRAINING_ARGS"]]
+    spawn_env = dict(os.environ, **env["ENV"])
+    status = subprocess.call(command, env=spawn_env)
+    if status:
+        return status
+
+    data = sorted(_pgo_data(data_dir, PGO_DATA_SUFFIXES[kind]))
+    if not data:
+        print("%s: training left no profile in %s" % (target[0], data_dir))
+        return 1
+    if kind == "clang":
+        return subprocess.call(
+            [env.subst("$LLVM_PROFDATA"), "merge", "-output=" + str(target[0])] + data,
+            env=spawn_env,
+        )
+    # gcc reads the .gcda files where training wrote them; list them with
+    # their digests, so the target changes with the profile
+    with open(str(target[0]), "w") as f:
+        for path in data:
+            with open(path, "rb") as gcda:
+                digest = hashlib.sha256(gcda.read()).hexdigest()
+            f.write("%s %s\n" % (digest, os.path.relpath(path, data_dir)))
+    return 0
+
+
+def PGOExtension(env, modname, source, training, target=None, args=()):
+    """
+    Build extension modname from source with profile-guided and link-time
+    optimization, returning the optimized module, by default at
+    extension_filename(modname), for env.Whl("platlib", ...).
+
+    An instrumented build goes in build/pgo/<modname>/generate. Training
+    runs the Python script training (with args) with that module importable
+    as modname, and its parent packages importable from PGO_SOURCE_ROOT, by
+    default the project's src_root. The profile it leaves builds the module again in
+    build/pgo/<modname>/use with PGO_USE_FLAGS and LTO_FLAGS. Editing the
+    sources or the training script repeats all three stages. Both builds
+    compile the same UNITY_BUILD batches.
+    """
+    kind = compiler_kind(env)
+    if kind is None:
+        raise SCons.Errors.UserError(
+            "PGOExtension needs gcc or clang, not %s" % env.subst("$SHCC")
+        )
+    if target is None:
+        target = extension_filename(modname)
+    target = env.File(target)
+    base = env.Dir("#build/pgo/" + modname)
+    for key, value in PGO_FLAGS[kind].items():
+        env.SetDefault(**{key: value})
+    env.SetDefault(LLVM_PROFDATA="llvm-profdata")
+    src_root = env.get("PACKAGE_METADATA", {}).get("src_root", "")
+    env.SetDefault(PGO_SOURCE_ROOT="#" + src_root)
+
+    source = UnitySources(env, source, base.Dir("unity"))
+    overrides = dict(
+        PGO_COMPILER=kind,
+        PGO_DATA_DIR=base.Dir("data"),
+        PGO_PROFILE=base.File("profile"),
+        # precompiled headers are built without the stage's flags
+        _PYTHON_PCH_FLAGS="",
+        PYTHON_PCH_FILE=None,
+    )
+
+    def stage(name, flags):
+        stage_env = env.Clone(**overrides)
+        stage_env.Append(CCFLAGS=flags, SHLINKFLAGS=flags)
+        objects = []
+        for node in env.arg2nodes(source, env.fs.File):
+            if node.is_under(base):  # a unity batch
+                path = os.path.splitext(node.get_path(base))[0]
+            else:
+                path = os.path.splitext(_build_path(node))[0]
+            object_env = stage_env
+            if kind == "gcc":
+                # gcc names the .gcda, and identifies static functions in
+                # it, by -dumpbase, which defaults to the object's path
+                object_env = stage_env.Clone()
+                dumpbase = base.Dir("data").File(path).get_abspath()
+                object_env.Append(CCFLAGS=["-dumpbase", dumpbase])
+            objects.extend(
+                object_env.SharedObject(
+                    base.Dir(name).File(path + stage_env["SHOBJSUFFIX"]), node
+                )
+            )
+        return stage_env, objects
+
+    generate_env, generate_objects = stage("generate", ["$PGO_GENERATE_FLAGS"])
+    instrumented = generate_env.LoadableModule(
+        base.Dir("generate").File(target.name),
+        generate_objects,
+        LDMODULEPREFIX="",
+        LDMODULESUFFIX="",
+    )
+
+    profile = env.Command(
+        base.File("profile"),
+        [instrumented, env.File(training)],
+        SCons.Action.Action(
+            _pgo_train,
+            "Training $PGO_MODULE with ${SOURCES[1]}",
+            varlist=["PGO_MODULE", "PGO_TRAINING_ARGS", "PGO_SOURCE_ROOT"],
+        ),
+        PGO_MODULE=modname,
+        PGO_TRAINING_ARGS=list(args),
+        **overrides
+    )
+
+    use_env, use_objects = stage("use", ["$PGO_USE_FLAGS", "$LTO_FLAGS"])
+    env.Depends(use_objects, profile)
+    return use_env.LoadableModule(
+        target, use_objects, LDMODULEPREFIX="", LDMODULESUFFIX=""
+    )
+
+
+# sources merged by unity builds, by the suffix of their batches
+UNITY_SUFFIXES = {
+    ".c": (".c",),
+    ".cc": (".cc", ".cpp", ".cxx", ".c++", ".C"),
+}
+
+
+def _write_unity_source(target, source, env):
+    with open(str(target[0]), "w") as f:
+        f.write(source[0].read())
+
+
+def unity_batches(batches, count):
+    """
+    Return the number of unity batches UNITY_BUILD value batches asks for
+    when building count sources of one language, or 0 for separate objects.
+    """
+    if isinstance(batches, str):
+        batches = batches.strip().lower()
+        if batches in ("", "0", "false", "no", "off"):
+            batches = 0
+        elif batches in ("auto", "true", "yes", "on"):
+            batches = True
+        else:
+            batches = int(batches)
+    if batches is True:
+        from .util import cpu_count
+
+        batches = cpu_count()
+    if not batches or count < 2:
+        return 0
+    return min(int(batches), count)
+
+
+def UnitySources(env, source, directory, batches=None):
+    """
+    Return source with its C and C++ files merged into batches, by default
+    UNITY_BUILD, of generated translation units in directory that #include
+    them. Other sources, and those in UNITY_EXCLUDE, are returned
+    unchanged.
+
+    Sources are sorted by path and split into contiguous batches, so editing
+    one recompiles only its batch; adding or removing a source may move the
+    others between batches.
+    """
+    if batches is None:
+        batches = env.get("UNITY_BUILD")
+    directory = env.Dir(directory)
+    exclude = set(env.arg2nodes(env.get("UNITY_EXCLUDE", []), env.fs.File))
+    languages = dict((suffix, []) for suffix in UNITY_SUFFIXES)
+    result = []
+    for item in SCons.Util.flatten(source):
+        name = env.subst(item) if SCons.Util.is_String(item) else item.name
+        for suffix, suffixes in UNITY_SUFFIXES.items():
+            if name.endswith(suffixes) and env.File(item) not in exclude:
+                languages[suffix].append(env.File(item))
+                break
+        else:
+            result.append(item)
+
+    for suffix, nodes in languages.items():
+        count = unity_batches(batches, len(nodes))
+        if not count:
+            result.extend(nodes)
+            continue
+        nodes.sort(key=lambda node: node.srcnode().get_abspath())
+        for i in range(count):
+            batch = nodes[i * len(nodes) // count : (i + 1) * len(nodes) // count]
+            # quoted includes are found relative to the including file
+            content = "".join(
+                ["/* generated by enscons.cpyext.UnitySources */\n"]
+                + [
+                    '#include "%s"\n'
+                    % os.path.relpath(
+                        node.srcnode().get_abspath(), directory.get_abspath()
+                    ).replace(os.sep, "/")
+                    for node in batch
+                ]
+            )
+            result.extend(
+                env.Command(
+                    directory.File("unity_%d%s" % (i, suffix)),
+                    env.Value(content),
+                    _write_unity_source,
+                )
+            )
+    return result
+
+
+# ELF section and note types
+SHT_NOTE = 7
+NT_GNU_BUILD_ID = 3
+
+
+def build_id(path):
+    """
+    Return the GNU build ID of ELF file path as hex, or None.
+    """
+    import struct
+
+    with open(path, "rb") as f:
+        ident = f.read(16)
+        if ident[:4] != b"\x7fELF":
+            return None
+        bits64 = ident[4] == 2
+        order = "<" if ident[5] == 1 else ">"
+        f.seek(0x28 if bits64 else 0x20)
+        (shoff,) = struct.unpack(
+            order + ("Q" if bits64 else "I"), f.read(8 if bits64 else 4)
+        )
+        f.seek(0x3A if bits64 else 0x2E)
+        shentsize, shnum = struct.unpack(order + "HH", f.read(4))
+        header = order + ("IIQQQQ" if bits64 else "IIIIII")
+        for i in range(shnum):
+            f.seek(shoff + i * shentsize)
+            fields = struct.unpack(header, f.read(struct.calcsize(header)))
+            if fields[1] != SHT_NOTE:
+                continue
+            f.seek(fields[4])
+            notes = f.read(fields[5])
+            offset = 0
+            while offset + 12 <= len(notes):
+                namesz, descsz, kind = struct.unpack_from(order + "III", notes, offset)
+                offset += 12
+                name = notes[offset : offset + namesz]
+                offset += (namesz + 3) & ~3
+                desc = notes[offset : offset + descsz]
+                offset += (descsz + 3) & ~3
+                if kind == NT_GNU_BUILD_ID and name == b"GNU\0":
+                    return desc.hex()
+    return None
+
+
+def _split_debug_emitter(target, source, env):
+    debug = env.Dir(env["SPLIT_DEBUG_DIR"]).File(_build_path(target[0]) + ".debug")
+    debug.attributes.split_debug = True
+    return target + [debug], source
+
+
+def SplitDebug(env):
+    """
+    Move the debug information of each SharedLibrary and LoadableModule env
+    or its later clones link into SPLIT_DEBUG_DIR/<library>.debug, linked
+    from the stripped library by build ID and .gnu_debuglink. Return False
+    if the platform does not use ELF or OBJCOPY is not found.
+    """
+    env.SetDefault(
+        OBJCOPY="objcopy",
+        SPLIT_DEBUG_DIR="#build/debug",
+        SPLIT_DEBUG_STRIPFLAGS=["--strip-debug"],
+    )
+    if sys.platform in ("darwin", "win32") or not env.WhereIs(env.subst("$OBJCOPY")):
+        return False
+    commands = [
+        "$OBJCOPY --only-keep-debug $TARGET ${TARGETS[-1]}",
+        "$OBJCOPY $SPLIT_DEBUG_STRIPFLAGS --add-gnu-debuglink=${TARGETS[-1]} $TARGET",
+    ]
+    for com in ("SHLINKCOM", "LDMODULECOM"):
+        if commands[-1] not in env[com]:
+            env[com] = SCons.Util.flatten([env[com]]) + commands
+    for emitter in ("SHLIBEMITTER", "LDMODULEEMITTER"):
+        if _split_debug_emitter not in env[emitter]:
+            env.Append(**{emitter: [_split_debug_emitter]})
+    # gdb and debuginfod find .build-id/xx/yyyy.debug
+    if "-Wl,--build-id" not in env["SHLINKFLAGS"]:
+        env.Append(SHLINKFLAGS=["-Wl,--build-id"])
+    return True
+
+
+def _debug_archive(target, source, env):
+    import time
+    import zipfile
+
+    from . import SOURCE_EPOCH_ZIP
+
+    date_time = time.gmtime(SOURCE_EPOCH_ZIP)[:6]
+    with zipfile.ZipFile(str(target[0]), "w", zipfile.ZIP_DEFLATED) as archive:
+        for node in source:
+            path = str(node)
+            identity = build_id(path)
+            if identity:
+                arcname = ".build-id/%s/%s.debug" % (identity[:2], identity[2:])
+            else:
+                arcname = node.name
+            with open(path, "rb") as f:
+                archive.writestr(zipfile.ZipInfo(arcname, date_time), f.read())
+
+
+def DebugArchive(env, target, source):
+    """
+    Zip the debug files split from source, libraries linked with SPLIT_DEBUG,
+    by build ID: a companion archive for a debug-file-directory or
+    debuginfod.
+    """
+    debug = []
+    for node in env.arg2nodes(source, env.fs.File):
+        if getattr(node.attributes, "split_debug", False):
+            debug.append(node)
+        elif node.has_builder():
+            debug.extend(
+                peer
+                for peer in node.get_executor().get_all_targets()
+                if getattr(peer.attributes, "split_debug", False)
+            )
+    return env.Command(
+        target,
+        debug,
+        SCons.Action.Action(_debug_archive, "Archiving debug files in $TARGET"),
+    )
+
+
+class ExtensionBuilder(object):
+    """
+    Wrap the SharedLibrary or LoadableModule builder to compile the C and C++
+    sources of each library in UNITY_BUILD batches, generated under
+    build/unity/<library>/, and to return libraries without their
+    SPLIT_DEBUG files, so they can go straight to Whl. Otherwise it is the
+    wrapped builder.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+
+    def __getattr__(self, name):
+        return getattr(self.builder, name)
+
+    def __call__(self, env, target=None, source=None, *args, **kw):
+        unity = kw.get("UNITY_BUILD", env.get("UNITY_BUILD"))
+        if unity and source is not None:
+            name = target
+            if name is None:
+                name = SCons.Util.flatten(source)[0]
+            if SCons.Util.is_List(name):
+                name = name[0]
+            if SCons.Util.is_String(name):
+                name = env.File(env.subst(name))
+            directory = env.Dir("#build/unity").Dir(_build_path(name))
+            source = UnitySources(env, source, directory, unity)
+        result = self.builder(env, target, source, *args, **kw)
+        return result.__class__(
+            node
+            for node in result
+            if not getattr(node.attributes, "split_debug", False)
+        )
+
+
 def generate(env):
-    global ext  # debugging
+    from . import compilecache
+
+    compiler = compiler_config()
 
-    # Compare compiler with ext.compiler.
-    # Actually this has side effects adding redundant arguments to ext's compiler.
-    # Could copy the compiler from ext before run() is called.
-    if False:
-        compiler = setuptools.ccompiler.new_compiler()
-        setuptools.sysconfig.customize_compiler(compiler)
+    # COMPILE_CACHE
+    compilecache.generate(env)
 
-    ext = get_build_ext()
+    env.AddMethod(PythonPCH)
+    env.AddMethod(PGOExtension)
+    env.AddMethod(UnitySources)
+    env.AddMethod(SplitDebug)
+    env.AddMethod(DebugArchive)
+
+    # UNITY_BUILD: batches per library, True or "auto" for one per CPU
+    env.SetDefault(UNITY_BUILD=os.environ.get("ENSCONS_UNITY_BUILD"))
+    for name in ("SharedLibrary", "LoadableModule"):
+        builder = env["BUILDERS"].get(name)
+        if builder is not None and not isinstance(builder, ExtensionBuilder):
+            env["BUILDERS"][name] = ExtensionBuilder(builder)
 
     # Sanity checks that shared compiler startswith normal compiler?
-    compiler = ext.compiler
-    if not hasattr(compiler, "compiler"):  # assume Windows
+    if compiler.msvc:
         return generate_msvc(env, compiler)
 
     env.Replace(CC=compiler.compiler[0])
@@ -124,6 +813,15 @@ def generate(env):
     env.Append(LIBPATH=compiler.library_dirs)
     env.Append(LIBS=compiler.libraries)
 
+    # PYTHON_PCH: True, or a list of headers to precompile
+    if env.get("PYTHON_PCH"):
+        headers = env["PYTHON_PCH"]
+        env.PythonPCH(*(() if headers is True else (headers,)))
+
+    # SPLIT_DEBUG: ship stripped libraries, with debug files kept aside
+    if env.get("SPLIT_DEBUG"):
+        env.SplitDebug()
+
     # Interesting environment variables:
     # CC, CXX, AS, AR, RANLIB, CPPPATH, CCFLAGS, CXXFLAGS, LINKFLAGS
 
@@ -133,7 +831,8 @@ def generate(env):
 
 def generate_msvc(env, compiler):
     """
-    Set SCons environment from distutils msvc9compiler
+    Set SCons environment from distutils msvc9compiler, as cached by
+    compiler_config()
     """
     import pprint
 
@@ -0,0 +1,289 @@
+"""
+Cython support for enscons.
+
+Add the tool after enscons.cpyext:
+
+    env = Environment(tools=["default", cpyext.generate, cython.generate])
+    ext = env.LoadableModule(cpyext.extension_filename("pkg.mod"), ["src/pkg/mod.pyx"])
+
+.pyx sources become C through the CFile builder, next to the source, so
+SharedObject, SharedLibrary and LoadableModule accept them. A scanner follows
+cimport, from ... cimport and include to .pxd and .pxi files in the source's
+directory, its parent packages and CYTHONPATH, so C is regenerated only when
+one of those or the Cython command line changes. Each translation is its own
+target and runs in parallel under -j.
+
+With CYTHON_CACHE set, generated C is kept in an enscons.cache.Cache under
+CYTHON_CACHE_DIR, keyed by the command line, the Cython version, and the
+contents of the source and everything it cimports or includes. Sources
+declaring public or api functions, which write headers besides the C file,
+are not cached.
+"""
+
+import atexit
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import threading
+
+import SCons.Action
+import SCons.Node.FS
+import SCons.Scanner
+import SCons.Tool
+import SCons.Util
+
+from .cache import Cache, DEFAULT_CACHE_SIZE
+
+# bump when the key or the entry format changes
+CACHE_VERSION = b"enscons-cython-1"
+
+CYTHON_SUFFIXES = [".pyx", ".pxd", ".pxi"]
+
+DEPENDENCY_RE = re.compile(
+    r"""^[ \t]*(?:
+        cimport[ \t]+(?P<cimport>[\w. \t,]+)
+        | from[ \t]+(?P<package>[\w.]+)[ \t]+cimport[ \t]+\(?(?P<names>[\w. \t,]+)
+        | include[ \t]+["'](?P<include>[^"']+)["']
+    )""",
+    re.MULTILINE | re.VERBOSE,
+)
+
+# declarations that make Cython write a header besides the C file
+HEADER_RE = re.compile(rb"^[ \t]*c?(?:def|class)\b.*\b(?:public|api)\b", re.MULTILINE)
+
+_versions = {}
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _names(text):
+    """
+    Return the module names in "a.b as c, d".
+    """
+    return [name.split()[0] for name in text.split(",") if name.strip()]
+
+
+def dependencies(contents):
+    """
+    Return the modules cimported by Cython source contents, with relative
+    names starting with dots, and the files it includes.
+    """
+    modules = []
+    includes = []
+    for match in DEPENDENCY_RE.finditer(contents):
+        if match.group("cimport"):
+            modules.extend(_names(match.group("cimport")))
+        elif match.group("package"):
+            package = match.group("package")
+            modules.append(package)
+            # from package cimport module
+            separator = "" if package.endswith(".") else "."
+            for name in _names(match.group("names")):
+                modules.append(package + separator + name)
+        else:
+            includes.append(match.group("include"))
+    return modules, includes
+
+
+def _package_dirs(directory):
+    """
+    Return directory and its parents, where absolute cimports from a
+    package may be rooted.
+    """
+    dirs = [directory]
+    while directory.up() is not None and directory.up() is not directory:
+        directory = directory.up()
+        dirs.append(directory)
+    return dirs
+
+
+def _find_module(name, directory, path):
+    relative = len(name) - len(name.lstrip("."))
+    if relative:
+        for i in range(relative - 1):
+            directory = directory.up() or directory
+        dirs = (directory,)
+    else:
+        dirs = tuple(_package_dirs(directory)) + tuple(path)
+    name = name[relative:].replace(".", "/")
+    if not name:
+        candidates = ["__init__.pxd"]
+    else:
+        candidates = [name + ".pxd", name + "/__init__.pxd"]
+    for candidate in candidates:
+        node = SCons.Node.FS.find_file(candidate, dirs)
+        if node is not None:
+            return node
+    return None
+
+
+def scan(node, env, path=()):
+    """
+    Return the .pxd and .pxi files Cython source node depends on.
+    """
+    if not node.exists() and not node.rexists():
+        return []
+    directory = node.get_dir()
+    modules, includes = dependencies(node.get_text_contents())
+    found = []
+    if node.name.endswith(".pyx"):  # the module's own declarations
+        found.append(SCons.Node.FS.find_file(node.name[:-4] + ".pxd", (directory,)))
+    for name in modules:
+        found.append(_find_module(name, directory, path))
+    for name in includes:
+        found.append(SCons.Node.FS.find_file(name, (directory,) + tuple(path)))
+    result = []
+    for dependency in found:
+        if dependency is not None and dependency is not node:
+            if dependency not in result:
+                result.append(dependency)
+    return result
+
+
+CythonScanner = SCons.Scanner.Scanner(
+    function=scan,
+    name="CythonScanner",
+    skeys=CYTHON_SUFFIXES,
+    path_function=SCons.Scanner.FindPathDirs("CYTHONPATH"),
+    recursive=True,
+)
+
+
+def _cython_version(env):
+    command = env.subst("$CYTHON")
+    if command not in _versions:
+        try:
+            result = subprocess.run(
+                [str(arg) for arg in env.subst_list("$CYTHON --version")[0]],
+                env=env["ENV"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            _versions[command] = result.stdout
+        except OSError:
+            _versions[command] = None
+    return _versions[command]
+
+
+def _close_caches():
+    for cache in _caches.values():
+        cache.evict()
+
+
+def get_cache(path=None, max_size=DEFAULT_CACHE_SIZE):
+    """
+    Return the process' Cache of generated C at path, by default under the
+    user cache directory.
+    """
+    if path is None:
+        from .util import user_cache_dir
+
+        path = os.path.join(user_cache_dir(), "cython")
+    path = os.path.abspath(path)
+    with _caches_lock:
+        if path not in _caches:
+            if not _caches:
+                atexit.register(_close_caches)
+            _caches[path] = Cache(path, max_size)
+        return _caches[path]
+
+
+def cache_key(target, source, env):
+    """
+    Return the cache key for translating source into target, or None if the
+    translation may not be cached.
+    """
+    contents = source[0].get_contents()
+    if HEADER_RE.search(contents):
+        return None
+    version = _cython_version(env)
+    if version is None:
+        return None
+    h = hashlib.sha256(CACHE_VERSION)
+    h.update(version)
+    h.update(env.subst("$CYTHONCOM", target=target, source=source).encode("utf-8"))
+    h.update(hashlib.sha256(contents).digest())
+    # scanned when the target was considered for building
+    for dependency in sorted(target[0].implicit or [], key=str):
+        h.update(str(dependency).encode("utf-8"))
+        h.update(dependency.get_csig().encode("utf-8"))
+    return h.hexdigest()
+
+
+CythonCommand = SCons.Action.Action("$CYTHONCOM", "$CYTHONCOMSTR")
+
+
+def cython(target, source, env):
+    """
+    Translate source to target, reusing C generated from identical inputs.
+    """
+    cache = key = None
+    if env.get("CYTHON_CACHE"):
+        directory = env.get("CYTHON_CACHE_DIR")
+        cache = get_cache(
+            directory and str(env.Dir(directory)), env["CYTHON_CACHE_SIZE"]
+        )
+        key = cache_key(target, source, env)
+    if key is not None:
+        data = cache.read(key)
+        if data is not None:
+            print("Cython cache: %s" % target[0])
+            with open(str(target[0]), "wb") as f:
+                f.write(data)
+            return 0
+    status = CythonCommand(target, source, env, show=False)
+    if status == 0 and key is not None:
+        try:
+            with open(str(target[0]), "rb") as f:
+                cache.write(key, f.read())
+        except OSError:  # full or read-only cache; the C is generated
+            pass
+    return status
+
+
+CythonAction = SCons.Action.Action(
+    cython,
+    CythonCommand.strfunction,
+    varlist=["CYTHONCOM", "CYTHON", "CYTHONFLAGS", "CYTHONPATH"],
+)
+
+
+def emitter(target, source, env):
+    """
+    Name the generated file .cpp when translating to C++.
+    """
+    if "--cplus" in env.subst_list("$CYTHONFLAGS")[0]:
+        base = os.path.splitext(str(target[0]))[0]
+        target = [env.File(base + env["CYTHONCPLUSSUFFIX"])] + target[1:]
+    return target, source
+
+
+def generate(env):
+    """
+    Translate .pyx sources with Cython.
+    """
+    c_file, _ = SCons.Tool.createCFileBuilders(env)
+    c_file.add_action(".pyx", CythonAction)
+    c_file.add_emitter(".pyx", emitter)
+    if CythonScanner not in env["SCANNERS"]:
+        env.Append(SCANNERS=[CythonScanner])
+
+    env.SetDefault(
+        CYTHON=SCons.Util.CLVar([sys.executable, "-m", "cython"]),
+        CYTHONFLAGS=SCons.Util.CLVar(""),
+        CYTHONPATH=[],
+        CYTHONCPLUSSUFFIX=".cpp",
+        CYTHON_CACHE=False,
+        CYTHON_CACHE_DIR=None,
+        CYTHON_CACHE_SIZE=DEFAULT_CACHE_SIZE,
+    )
+    env["_CYTHONINCFLAGS"] = (
+        "${_concat('-I', CYTHONPATH, '', __env__, RDirs, TARGET, SOURCE)}"
+    )
+    env["CYTHONCOM"] = "$CYTHON $CYTHONFLAGS $_CYTHONINCFLAGS -o $TARGET $SOURCE"
+
+
+def exists(env):
+    return True
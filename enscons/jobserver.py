@@ -0,0 +1,305 @@
+"""
+GNU make jobserver client, and a simple local jobserver.
+
+make -jN shares N job slots with every process it runs through a pipe, or a
+named fifo, holding N-1 tokens, advertised in MAKEFLAGS as
+--jobserver-auth=R,W or --jobserver-auth=fifo:PATH. Each process owns one
+implicit slot; every further job it runs at once reads a token from the
+pipe and writes it back when done. enscons takes a slot around each command
+it spawns and each member or block it compresses, so builds started by make,
+or by pip or tox under make, share the machine instead of each running its
+own -j.
+
+Outside make, run the builds under a local jobserver:
+
+    python -m enscons.jobserver -j 16 -- tox -p
+
+Without a jobserver, slot() does nothing.
+"""
+
+import argparse
+import atexit
+import contextlib
+import os
+import select
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+
+AUTH_PREFIXES = ("--jobserver-auth=", "--jobserver-fds=")  # fds is make < 4.2
+
+_lock = threading.Lock()
+_client = None
+_checked = False
+_held = threading.local()  # slots held by this thread, counting nested ones
+
+
+def parse_makeflags(makeflags):
+    """
+    Return the jobserver address in makeflags: a fifo path, a (read, write)
+    pair of file descriptors, or None.
+    """
+    auth = None
+    for word in makeflags.split():
+        for prefix in AUTH_PREFIXES:
+            if word.startswith(prefix):
+                auth = word[len(prefix) :]  # the last one wins
+    if not auth:
+        return None
+    if auth.startswith("fifo:"):
+        return auth[len("fifo:") :]
+    try:
+        read_fd, write_fd = (int(fd) for fd in auth.split(","))
+    except ValueError:  # a Windows semaphore name
+        return None
+    if read_fd < 0 or write_fd < 0:
+        return None
+    return read_fd, write_fd
+
+
+def _is_fifo(fd):
+    try:
+        return stat.S_ISFIFO(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+
+def _nonblocking(fd):
+    """
+    Return a descriptor reading the jobserver pipe fd without blocking.
+    make and the other clients share fd's open file description, and its
+    flags with it, so reopen the pipe where the system allows rather than
+    setting O_NONBLOCK on fd. Otherwise return fd, whose reads may block
+    until a token arrives when another process takes the one select()
+    saw.
+    """
+    if not os.get_blocking(fd):
+        return fd
+    try:
+        # Linux opens a new file description of the same pipe
+        return os.open("/proc/self/fd/%d" % fd, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return fd
+
+
+class Client(object):
+    """
+    Job slots from a jobserver's read and write file descriptors.
+    """
+
+    def __init__(self, read_fd, write_fd):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self._lock = threading.Lock()
+        self._implicit = True  # our own slot is free
+        self._tokens = []  # tokens read from the jobserver, to give back
+        # wakes threads waiting on the jobserver when our own slot is freed
+        self._waiting = 0
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+
+    @classmethod
+    def from_environ(cls, environ=os.environ):
+        """
+        Return a Client for the jobserver in environ["MAKEFLAGS"], or None.
+        """
+        address = parse_makeflags(environ.get("MAKEFLAGS", ""))
+        if address is None:
+            return None
+        if isinstance(address, tuple):
+            # make closes the descriptors for commands not marked as
+            # recursive; don't read whatever file reused the numbers
+            if not all(_is_fifo(fd) for fd in address):
+                return None
+            read_fd, write_fd = address
+            return cls(_nonblocking(read_fd), write_fd)
+        try:
+            fd = os.open(address, os.O_RDWR | os.O_NONBLOCK)
+        except OSError:
+            return None
+        return cls(fd, fd)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if self._implicit:
+                    self._implicit = False
+                    return
+                self._waiting += 1
+            try:
+                ready, _, _ = select.select([self.read_fd, self._wake_r], [], [])
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if self._wake_r in ready:
+                try:
+                    os.read(self._wake_r, 1)
+                except BlockingIOError:  # another waiter took the wakeup
+                    pass
+                continue
+            try:
+                token = os.read(self.read_fd, 1)
+            except (BlockingIOError, InterruptedError):
+                continue  # another process took it first
+            if not token:
+                raise EOFError("jobserver closed")
+            with self._lock:
+                self._tokens.append(token)
+            return
+
+    def release(self):
+        with self._lock:
+            if not self._tokens:
+                self._implicit = True
+                if self._waiting:
+                    os.write(self._wake_w, b"+")
+                return
+            token = self._tokens.pop()
+        os.write(self.write_fd, token)
+
+    def release_all(self):
+        """
+        Give back every token, even those of jobs still running.
+        """
+        with self._lock:
+            tokens, self._tokens = self._tokens, []
+        for token in tokens:
+            os.write(self.write_fd, token)
+
+
+def get():
+    """
+    Return the process' Client, or None when not run under a jobserver.
+    """
+    global _client, _checked
+    with _lock:
+        if not _checked:
+            _client = Client.from_environ()
+            if _client is not None:
+                # make loses slots whose tokens are never written back
+                atexit.register(_client.release_all)
+            _checked = True
+        return _client
+
+
+@contextlib.contextmanager
+def slot():
+    """
+    Context manager holding one job slot, if there is a jobserver. A thread
+    already holding one, such as SPAWN wrappers stacked on each other,
+    keeps it rather than waiting for another.
+    """
+    client = get()
+    depth = getattr(_held, "depth", 0)
+    if client is None or depth:
+        _held.depth = depth + 1
+        try:
+            yield
+        finally:
+            _held.depth = depth
+        return
+    client.acquire()
+    _held.depth = 1
+    try:
+        yield
+    finally:
+        _held.depth = 0
+        client.release()
+
+
+def call(func, *args):
+    """
+    Return func(*args), called holding a job slot.
+    """
+    with slot():
+        return func(*args)
+
+
+def generate(env):
+    """
+    Take a job slot around each command env spawns.
+    """
+    if get() is None:
+        return
+    spawn = env["SPAWN"]
+    if getattr(spawn, "jobserver", False):
+        return
+
+    def jobserver_spawn(sh, escape, cmd, args, spawn_env):
+        with slot():
+            return spawn(sh, escape, cmd, args, spawn_env)
+
+    jobserver_spawn.jobserver = True
+    env["SPAWN"] = jobserver_spawn
+
+
+class Server(object):
+    """
+    A jobserver of job slots on a named fifo, for the duration of a with
+    block.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.directory = None
+        self.fd = None
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix="enscons-jobserver-")
+        self.path = os.path.join(self.directory, "fifo")
+        os.mkfifo(self.path, 0o600)
+        self.fd = os.open(self.path, os.O_RDWR)
+        os.write(self.fd, b"+" * (self.jobs - 1))
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+        shutil.rmtree(self.directory)
+
+    def makeflags(self, makeflags=""):
+        """
+        Return makeflags advertising this jobserver instead of any other.
+        """
+        words = [
+            word
+            for word in makeflags.split()
+            if not word.startswith(AUTH_PREFIXES) and not word.startswith("-j")
+        ]
+        words += ["-j%d" % self.jobs, AUTH_PREFIXES[0] + "fifo:" + self.path]
+        return " ".join(words)
+
+
+def main(argv=None):
+    from .util import cpu_count
+
+    parser = argparse.ArgumentParser(
+        prog="python -m enscons.jobserver",
+        description="Run command sharing job slots with the builds it starts.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=cpu_count(),
+        help="job slots (default: available CPUs)",
+    )
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    command = args.command
+    if command[:1] == ["--"]:
+        command = command[1:]
+    if not command:
+        parser.error("no command")
+    if get() is not None:  # already under make; share its slots
+        return subprocess.call(command)
+    with Server(max(args.jobs, 1)) as server:
+        env = dict(os.environ)
+        env["MAKEFLAGS"] = server.makeflags(env.get("MAKEFLAGS", ""))
+        return subprocess.call(command, env=env)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+"""
+Render wheel metadata from a PEP 621 [project] table.
+
+Nothing here imports SCons, so the PEP 517 backend can prepare a wheel's
+.dist-info without reading SConstruct when pyproject.toml declares
+everything needed:
+
+    [tool.enscons]
+    wheel-tag = "py3-none-any"
+    root-is-purelib = true  # optional, defaults to tag ending in none-any
+
+model() returns the parsed Metadata for a table, shared by everything that
+renders it, from METADATA and PKG-INFO to .egg-info.
+"""
+
+import codecs
+import io
+import json
+import os
+
+from .util import safe_name, to_filename, generate_requirements
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+def _is_string(obj):
+    # Python 2 compatibility.
+    return isinstance(obj, basestring)
+
+
+def _write_header(f, name, value):
+    lines = value.splitlines() or [""]
+    f.write("%s: %s\n" % (name, lines[0]))
+    for line in lines[1:]:
+        f.write("  %s\n" % line)
+
+
+def _write_contacts(f, header_name, header_email, contacts):
+    if len(contacts) == 1:
+        if "name" in contacts[0]:
+            _write_header(f, header_name, contacts[0]["name"])
+        if "email" in contacts[0]:
+            _write_header(f, header_email, contacts[0]["email"])
+    else:
+        value = ", ".join(
+            (
+                contact["email"]
+                if "name" not in contact
+                else (
+                    contact["name"]
+                    if "email" not in contact
+                    else "%(name)s <%(email)s>" % contact
+                )
+            )
+            for contact in contacts
+        )
+        emails = any("email" in contact for contact in contacts)
+        _write_header(f, header_email if emails else header_name, value)
+
+
+def normalize_package(name):
+    # XXX encourage project names to start out 'safe'
+    return to_filename(safe_name(name))
+
+
+def dist_info_name(metadata):
+    return "%s-%s.dist-info" % (
+        normalize_package(metadata["name"]),
+        metadata["version"],
+    )
+
+
+def _readme_type(filename):
+    lowername = filename.lower()
+    if lowername.endswith(".rst"):
+        return "text/x-rst"
+    if lowername.endswith(".md"):
+        return "text/markdown"
+    if lowername.endswith(".txt"):
+        return "text/plain"
+    return None
+
+
+def _copy_file(f, filename, encoding="utf-8"):
+    with codecs.open(filename, mode="r", encoding=encoding) as source:
+        while True:
+            chunk = source.read(1 << 16)
+            if not chunk:
+                break
+            f.write(chunk)
+
+
+def _write_file_header(f, name, filename):
+    """
+    Write the contents of filename as header name, a line at a time.
+    """
+    with codecs.open(filename, mode="r", encoding="utf-8") as source:
+        # the reader splits lines like str.splitlines()
+        lines = (line.splitlines()[0] for line in source)
+        f.write("%s: %s\n" % (name, next(lines, "")))
+        for line in lines:
+            f.write("  %s\n" % line)
+
+
+class Metadata(object):
+    """
+    A PEP 621 [project] table, parsed once. Everything derived from the
+    table alone, such as requirement headers and entry points, is rendered
+    on first use and kept; readme and license files are copied into each
+    output as it is written, so their current contents are used.
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self._rendered = {}
+
+    def _render(self, name, writer):
+        if name not in self._rendered:
+            f = io.StringIO()
+            writer(f)
+            self._rendered[name] = f.getvalue()
+        return self._rendered[name]
+
+    def requirements(self):
+        """
+        Return {extra: [requirements]}, with "" holding the base
+        dependencies.
+        """
+        metadata = self.metadata
+        full_requires = {}
+        full_requires.update(metadata.get("extras_require", {}))
+        full_requires.update(metadata.get("optional-dependencies", {}))
+        # install_requires is equivalent to extras_require[""][...]
+        if "install_requires" in metadata:
+            full_requires[""] = metadata["install_requires"]
+        if "dependencies" in metadata:
+            full_requires[""] = metadata["dependencies"]
+        return full_requires
+
+    def source(self):
+        """
+        Return the files METADATA is rendered from.
+        """
+        source = ["pyproject.toml"]
+        if self._license_file():
+            source.append(self._license_file())
+        readme = self._readme()
+        if readme[0]:
+            source.append(readme[0])
+        return source
+
+    def _license_file(self):
+        license = self.metadata.get("license")
+        if license is None or _is_string(license) or "text" in license:
+            return None
+        return license["file"]
+
+    def _readme(self):
+        """
+        Return the readme's (filename, encoding, content type, text).
+        """
+        metadata = self.metadata
+        if "readme" in metadata:
+            readme = metadata["readme"]
+            if _is_string(readme):
+                return readme, "utf-8", _readme_type(readme), None
+            if "file" in readme:
+                filename = readme["file"]
+                contenttype = readme.get("content-type") or _readme_type(filename)
+                return filename, readme.get("encoding", "utf-8"), contenttype, None
+            return None, None, readme.get("content-type"), readme["text"]
+        if "description_file" in metadata:
+            # Backward compatibility; no content type.
+            return metadata["description_file"], "utf-8", None, None
+        return None, None, None, None
+
+    def _write_head(self, f):
+        metadata = self.metadata
+        f.write("Metadata-Version: 2.1\n")
+        # Key meanings in accordance with PEP 621, with minor
+        # extensions for backward compatibility. The "dynamic"
+        # key is not implemented.
+        f.write("Name: %s\n" % metadata["name"])
+        f.write("Version: %s\n" % metadata["version"])
+        if "description" in metadata:
+            _write_header(f, "Summary", metadata["description"])
+        if "requires-python" in metadata:
+            _write_header(f, "Requires-Python", metadata["requires-python"])
+        license = metadata.get("license")
+        if license is not None and not self._license_file():
+            _write_header(
+                f, "License", license if _is_string(license) else license["text"]
+            )
+
+    def _write_tail(self, f):
+        metadata = self.metadata
+        if "authors" in metadata:
+            _write_contacts(f, "Author", "Author-email", metadata["authors"])
+        else:
+            # Non-PEP 621 keys.
+            if "author" in metadata:
+                _write_header(f, "Author", metadata["author"])
+            if "author_email" in metadata:
+                _write_header(f, "Author-email", metadata["author_email"])
+        if "maintainers" in metadata:
+            _write_contacts(
+                f, "Maintainer", "Maintainer-email", metadata["maintainers"]
+            )
+        if "keywords" in metadata:
+            _write_header(
+                f,
+                "Keywords",
+                (
+                    metadata["keywords"]
+                    if _is_string(metadata["keywords"])
+                    else ",".join(metadata["keywords"])
+                ),
+            )
+        for classifier in metadata.get("classifiers", []):
+            _write_header(f, "Classifier", classifier)
+        if "url" in metadata:
+            # This is not present in PEP 621.
+            _write_header(f, "Home-Page", metadata["url"])
+        for label, url in metadata.get("urls", {}).items():
+            _write_header(f, "Project-URL", "%s, %s" % (label, url))
+        if "platform" in metadata:
+            # Backward compatibility only.
+            _write_header(f, "Platform", metadata["platform"])
+        for requirement in generate_requirements(self.requirements()):
+            f.write("%s: %s\n" % requirement)
+        contenttype = self._readme()[2]
+        if contenttype:
+            _write_header(f, "Description-Content-Type", contenttype)
+
+    def write_metadata(self, f):
+        """
+        Write METADATA to text file f.
+        """
+        f.write(self._render("head", self._write_head))
+        if self._license_file():
+            # the license file goes where License: text would
+            _write_file_header(f, "License", self._license_file())
+        f.write(self._render("tail", self._write_tail))
+        filename, encoding, contenttype, text = self._readme()
+        if filename:
+            f.write("\n\n")
+            _copy_file(f, filename, encoding)
+        elif text is not None:
+            f.write("\n\n")
+            f.write(text)
+
+    def _write_entry_points(self, f):
+        metadata = self.metadata
+        entry_points = {}
+        if "entry_points" in metadata:
+            entry_points.update(metadata["entry_points"])
+        if "scripts" in metadata:
+            entry_points["console_scripts"] = metadata["scripts"]
+        if "gui-scripts" in metadata:
+            entry_points["gui_scripts"] = metadata["gui-scripts"]
+        for group, items in sorted(entry_points.items()):
+            f.write("[%s]\n" % group)
+            if isinstance(items, list):
+                # Non-PEP 621 extension: entry_point tables as lists of strings
+                for item in items:
+                    f.write("%s\n" % item)
+            else:
+                for key, value in sorted(items.items()):
+                    f.write("%s = %s\n" % (key, value))
+
+    def write_entry_points(self, f):
+        """
+        Write entry_points.txt to text file f.
+        """
+        f.write(self._render("entry_points", self._write_entry_points))
+
+    def _write_requires_txt(self, f):
+        for group, dependencies in sorted(self.requirements().items()):
+            if group:
+                f.write("\n[%s]\n" % group)
+            for dep in dependencies:
+                f.write("%s\n" % dep)
+
+    def write_requires_txt(self, f):
+        """
+        Write .egg-info requires.txt to text file f.
+        """
+        f.write(self._render("requires_txt", self._write_requires_txt))
+
+    def write_pkg_info(self, f):
+        """
+        Write the minimal .egg-info PKG-INFO pip reads to text file f.
+        """
+        f.write("Metadata-Version: 1.1\n")
+        f.write("Name: %s\n" % self.metadata["name"])
+        f.write("Version: %s\n" % self.metadata["version"])
+
+
+_models = {}
+
+
+def model(metadata):
+    """
+    Return the Metadata for [project] table metadata, shared by every
+    environment and build with an equal table.
+    """
+    key = json.dumps(metadata, sort_keys=True, default=str)
+    try:
+        return _models[key]
+    except KeyError:
+        pass
+    if len(_models) >= 16:  # a long session of edited metadata
+        _models.clear()
+    _models[key] = Metadata(metadata)
+    return _models[key]
+
+
+def requirements(metadata):
+    """
+    Return {extra: [requirements]}, with "" holding the base dependencies.
+    """
+    return model(metadata).requirements()
+
+
+def metadata_source(metadata):
+    """
+    Return the files METADATA is rendered from.
+    """
+    return model(metadata).source()
+
+
+def write_metadata(f, metadata):
+    """
+    Write METADATA for metadata to text file f.
+    """
+    model(metadata).write_metadata(f)
+
+
+def write_wheel(f, root_is_purelib, tag):
+    """
+    Write the WHEEL file to text file f.
+    """
+    f.write("Wheel-Version: 1.0\n")
+    f.write("Generator: enscons (0.0.1)\n")
+    f.write("Root-Is-Purelib: %s\n" % str(root_is_purelib).lower())
+    f.write("Tag: %s\n" % tag)
+
+
+def write_entry_points(f, metadata):
+    """
+    Write entry_points.txt for metadata to text file f.
+    """
+    model(metadata).write_entry_points(f)
+
+
+def static_wheel(pyproject):
+    """
+    Return (metadata, tag, root_is_purelib) if the parsed pyproject.toml
+    declares them statically, else None.
+    """
+    metadata = pyproject.get("project")
+    config = pyproject.get("tool", {}).get("enscons", {})
+    tag = config.get("wheel-tag")
+    if (
+        not metadata
+        or metadata.get("dynamic")
+        or "name" not in metadata
+        or "version" not in metadata
+        or not _is_string(tag)
+    ):
+        return None
+    root_is_purelib = config.get("root-is-purelib", tag.endswith("none-any"))
+    return metadata, tag, root_is_purelib
+
+
+def write_dist_info(directory, metadata, tag, root_is_purelib):
+    """
+    Write the .dist-info for a wheel into directory, returning its name.
+    """
+    name = dist_info_name(metadata)
+    dist_info = os.path.join(directory, name)
+    os.makedirs(dist_info, exist_ok=True)
+    for filename, writer, args in (
+        ("METADATA", write_metadata, (metadata,)),
+        ("WHEEL", write_wheel, (root_is_purelib, tag)),
+        ("entry_points.txt", write_entry_points, (metadata,)),
+    ):
+        path = os.path.join(dist_info, filename)
+        with codecs.open(path, mode="w", encoding="utf-8") as f:
+            writer(f, *args)
+    return name
@@ -4,7 +4,8 @@ Tool-specific initialization for tar (Python stdlib implementation)
 
 Based on SCons' tar and zip builders.
 
-This version supports anonymous tar and a path prefix inside the archive.
+This version supports anonymous tar, a path prefix inside the archive, and
+pigz-style gzip compression on several threads.
 """
 
 # Permission is hereby granted, free of charge, to any person obtaining
@@ -26,49 +27,374 @@ This version supports anonymous tar and a path prefix inside the archive.
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import collections
 import os.path
+import stat
+import struct
 import tarfile
+import zlib
 
 import SCons.Builder
 import SCons.Defaults
 import SCons.Node.FS
 import SCons.Util
 
+from . import jobserver
+
+try:
+    import grp
+    import pwd
+except ImportError:  # Windows
+    grp = pwd = None
+
 # Do we have to set certain headers for it to "really" be PAX format?
 _tarformat = tarfile.PAX_FORMAT
 
+# parallel gzip compresses independent blocks of this size
+GZIP_BLOCK_SIZE = 1 << 20
+# each block is primed with this much of the previous one, like pigz
+GZIP_DICT_SIZE = 1 << 15
+# buffer size for copying file bodies into the archive
+COPY_BUFSIZE = 1 << 20
+
+
+def _deflate_block(block, dictionary, compresslevel, last):
+    if dictionary:
+        compressor = zlib.compressobj(
+            compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary
+        )
+    else:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+
+
+class ParallelGzipFile(object):
+    """
+    Write-only file object producing a single standard gzip stream from
+    blocks compressed on a thread pool.
+
+    Every block but the last ends with a sync flush, so the compressed blocks
+    simply concatenate into one deflate stream. Priming each block with the
+    tail of the previous one keeps the ratio close to plain gzip. The output
+    depends only on the data and compresslevel, not on the number of threads.
+    """
+
+    def __init__(self, fileobj, compresslevel=9, threads=1, mtime=0, filename=""):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.dictionary = b""
+        self.crc = 0
+        self.size = 0
+        self._write_header(mtime, filename)
+
+    def _write_header(self, mtime, filename):
+        # same layout as gzip.GzipFile
+        fname = os.path.basename(filename).encode("latin-1", "replace")
+        if fname.endswith(b".gz"):
+            fname = fname[:-3]
+        xfl = {9: b"\002", 1: b"\004"}.get(self.compresslevel, b"\000")
+        self.fileobj.write(b"\037\213\010" + (b"\010" if fname else b"\000"))
+        self.fileobj.write(struct.pack("<L", int(mtime)) + xfl + b"\377")
+        if fname:
+            self.fileobj.write(fname + b"\000")
+
+    def _submit(self, block, last):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(
+            self.pool.submit(
+                jobserver.call,
+                _deflate_block,
+                block,
+                self.dictionary,
+                self.compresslevel,
+                last,
+            )
+        )
+        self.dictionary = block[-GZIP_DICT_SIZE:]
+        # bound the blocks held in memory
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= GZIP_BLOCK_SIZE:
+            block = bytes(self.buffer[:GZIP_BLOCK_SIZE])
+            del self.buffer[:GZIP_BLOCK_SIZE]
+            self._submit(block, False)
+        return len(data)
+
+    def tell(self):
+        """Uncompressed position, like gzip.GzipFile."""
+        return self.size + len(self.buffer)
+
+    def close(self):
+        if self.pool is None:
+            return
+        try:
+            self._submit(bytes(self.buffer), True)
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            self.fileobj.write(
+                struct.pack("<LL", self.crc & 0xFFFFFFFF, self.size & 0xFFFFFFFF)
+            )
+        finally:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _compress_threads(env):
+    threads = env.get("TARCOMPRESSTHREADS") or 1
+    if threads == "auto":
+        from .util import cpu_count
+
+        threads = cpu_count()
+    return int(threads)
+
 
 def tar(target, source, env):
     compression = env.get("TARCOMPRESSION", "")
+    threads = _compress_threads(env)
+    if compression == "gz" and threads > 1:
+        with open(str(target[0]), "wb") as f, ParallelGzipFile(
+            f,
+            compresslevel=env.get("TARCOMPRESSLEVEL", 9),
+            threads=threads,
+            mtime=env.get("TARMTIME") or 0,
+            filename=str(target[0]),
+        ) as gz:
+            _tar(target, source, env, mode="w", fileobj=gz)
+    else:
+        kwargs = {}
+        if compression in ("gz", "bz2"):
+            kwargs["compresslevel"] = env.get("TARCOMPRESSLEVEL", 9)
+        mode = "w" + (compression and ":") + compression
+        with jobserver.slot():
+            _tar(target, source, env, mode, **kwargs)
+
+
+def _tar(target, source, env, mode, **kwargs):
     tarformat = env.get("TARFORMAT", None)
     tarroot = str(env.get("TARROOT", ""))
     tarprefix = str(env.get("TARPREFIX", ""))
-    taruid = env.get("TARUID")
-    targid = env.get("TARGID")
-    tarmtime = env.get("TARMTIME")
     with tarfile.TarFile.open(
-        str(target[0]), "w" + (compression and ":") + compression, format=tarformat
+        str(target[0]), mode, format=tarformat, copybufsize=COPY_BUFSIZE, **kwargs
     ) as tar:
-
-        def _filter(info):
-            """Return potentially anonymize tarinfo"""
-            if taruid is not None:
-                info.uid = taruid
-                info.uname = ""
-            if targid is not None:
-                info.gid = targid
-                info.gname = ""
-            if tarmtime is not None:
-                info.mtime = tarmtime
-            return info
-
+        headers = TarHeaders(
+            tar, env.get("TARUID"), env.get("TARGID"), env.get("TARMTIME")
+        )
         for s in source:
-            arcname = os.path.relpath(str(s), tarroot)
+            path = str(s)
+            arcname = os.path.relpath(path, tarroot)
             arcname = os.path.join(tarprefix, arcname)
-            tar.add(str(s), arcname=arcname, filter=_filter)
+            # SCons memoizes the node's lstat()
+            st = s.lstat() or os.lstat(path)
+            _add(tar, headers, path, arcname, st)
+
+
+def _add(tar, headers, path, arcname, st):
+    """
+    Add path and, for directories, everything under it to tar. Equivalent
+    to tar.add() but walks with os.scandir, reusing the stat results it
+    returns, and builds headers without extra stat calls.
+    """
+    info = headers.tarinfo(path, arcname, st)
+    if info.isreg():
+        with open(path, "rb") as f:
+            headers.addfile(info, f)
+    elif info.isdir():
+        headers.addfile(info)
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        for entry in entries:
+            _add(
+                tar,
+                headers,
+                entry.path,
+                info.name + "/" + entry.name,
+                entry.stat(follow_symlinks=False),
+            )
+    else:
+        headers.addfile(info)
+
+
+class TarHeaders(object):
+    """
+    Build anonymized TarInfo headers from stat results, as
+    TarFile.gettarinfo() would, caching owner and group name lookups.
+
+    Headers that fit a plain ustar block are serialized here; anything
+    needing a pax extended header goes through TarFile.addfile().
+    """
 
+    def __init__(self, tar, uid=None, gid=None, mtime=None):
+        self.tar = tar
+        self.ustar = tar.format in (tarfile.USTAR_FORMAT, tarfile.PAX_FORMAT)
+        # magic, version, uname, gname and device fields as tarfile writes
+        # them for a regular file
+        reference = tarfile.TarInfo("").tobuf(tarfile.USTAR_FORMAT)
+        self.magic = reference[257:265]
+        self.devices = reference[329:345]
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.unames = {}
+        self.gnames = {}
 
-TarAction = SCons.Action.Action(tar, varlist=["TARCOMPRESSION"])
+    def _uname(self, uid):
+        try:
+            return self.unames[uid]
+        except KeyError:
+            name = ""
+            if pwd:
+                try:
+                    name = pwd.getpwuid(uid)[0]
+                except KeyError:
+                    pass
+            self.unames[uid] = name
+            return name
+
+    def _gname(self, gid):
+        try:
+            return self.gnames[gid]
+        except KeyError:
+            name = ""
+            if grp:
+                try:
+                    name = grp.getgrgid(gid)[0]
+                except KeyError:
+                    pass
+            self.gnames[gid] = name
+            return name
+
+    def tarinfo(self, path, arcname, st):
+        mode = st.st_mode
+        if stat.S_ISREG(mode) and st.st_nlink == 1:
+            info = self.tar.tarinfo(self._arcname(arcname))
+            info.type = tarfile.REGTYPE
+            info.size = st.st_size
+        elif stat.S_ISDIR(mode):
+            info = self.tar.tarinfo(self._arcname(arcname))
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            info = self.tar.tarinfo(self._arcname(arcname))
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(path)
+        else:
+            # hard links and special files; tarfile tracks inodes and devices
+            info = self.tar.gettarinfo(path, arcname)
+            return self.anonymize(info)
+        info.mode = mode
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+        info.mtime = st.st_mtime
+        if self.uid is None:
+            info.uname = self._uname(st.st_uid)
+        if self.gid is None:
+            info.gname = self._gname(st.st_gid)
+        return self.anonymize(info)
+
+    def _arcname(self, arcname):
+        # normalized as in TarFile.gettarinfo()
+        arcname = os.path.splitdrive(arcname)[1].replace(os.sep, "/")
+        return arcname.lstrip("/")
+
+    def tobuf(self, info):
+        """
+        Return info as a single ustar header block, or None if it needs
+        more than that.
+        """
+        name = info.name
+        if info.type == tarfile.DIRTYPE and not name.endswith("/"):
+            name += "/"
+        linkname = info.linkname
+        uname = info.uname
+        gname = info.gname
+        mtime = info.mtime
+        if not (
+            self.ustar
+            and len(name) <= tarfile.LENGTH_NAME
+            and len(linkname) <= tarfile.LENGTH_LINK
+            and len(uname) <= 32
+            and len(gname) <= 32
+            and name.isascii()
+            and linkname.isascii()
+            and uname.isascii()
+            and gname.isascii()
+            and isinstance(mtime, int)
+            and 0 <= mtime < 8**11
+            and 0 <= info.uid < 8**7
+            and 0 <= info.gid < 8**7
+            and 0 <= info.size < 8**11
+            and not info.pax_headers
+        ):
+            return None
+        buf = b"".join(
+            (
+                name.encode("ascii").ljust(100, tarfile.NUL),
+                b"%07o\0%07o\0%07o\0%011o\0%011o\0        "
+                % (info.mode & 0o7777, info.uid, info.gid, info.size, mtime),
+                info.type,
+                linkname.encode("ascii").ljust(100, tarfile.NUL),
+                self.magic,
+                uname.encode("ascii").ljust(32, tarfile.NUL),
+                gname.encode("ascii").ljust(32, tarfile.NUL),
+                self.devices,
+            )
+        ).ljust(tarfile.BLOCKSIZE, tarfile.NUL)
+        # checksum counts its own field as spaces
+        return b"%s%06o\0%s" % (buf[:148], sum(buf), buf[155:])
+
+    def addfile(self, info, fileobj=None):
+        """
+        Like TarFile.addfile(), writing simple headers directly.
+        """
+        tar = self.tar
+        buf = self.tobuf(info)
+        if buf is None:
+            tar.addfile(info, fileobj)
+            return
+        tar.fileobj.write(buf)
+        tar.offset += tarfile.BLOCKSIZE
+        if fileobj is not None:
+            tarfile.copyfileobj(fileobj, tar.fileobj, info.size, bufsize=COPY_BUFSIZE)
+            blocks, remainder = divmod(info.size, tarfile.BLOCKSIZE)
+            if remainder:
+                tar.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            tar.offset += blocks * tarfile.BLOCKSIZE
+        tar.members.append(info)
+
+    def anonymize(self, info):
+        """Return potentially anonymized tarinfo"""
+        if self.uid is not None:
+            info.uid = self.uid
+            info.uname = ""
+        if self.gid is not None:
+            info.gid = self.gid
+            info.gname = ""
+        if self.mtime is not None:
+            info.mtime = self.mtime
+        return info
+
+
+TarAction = SCons.Action.Action(
+    tar, varlist=["TARCOMPRESSION", "TARCOMPRESSLEVEL", "TARCOMPRESSTHREADS"]
+)
 
 TarBuilder = SCons.Builder.Builder(
     action=SCons.Action.Action("$TARCOM", "$TARCOMSTR"),
@@ -93,6 +419,9 @@ def generate(env):
     env["TARCOM"] = TarAction
     env["TARFORMAT"] = _tarformat
     env["TARCOMPRESSION"] = "gz"
+    env["TARCOMPRESSLEVEL"] = 9  # gz and bz2
+    # > 1 or "auto" compresses gz in parallel blocks, like pigz
+    env["TARCOMPRESSTHREADS"] = 1
     env["TARSUFFIX"] = ".tar"
     # prefix in the internal directory structure
     env["TARPREFIX"] = ""
@@ -0,0 +1,197 @@
+"""
+Warm SCons session for the PEP 517 backend.
+
+Session.read() reads SConstruct in SCons' interactive mode without building
+anything. Session.build() then builds an alias like an interactive ``build``
+command, so the parsed SConstruct, node graph and signatures stay warm for
+later hooks in the same process. Node state is reset after every build.
+
+Outputs are built in PEP517_DIR, independent of the directories passed by
+the frontend. The session is stale when the working directory or a file it
+was read from changes: SConstruct, the SConscripts it read, pyproject.toml,
+site_scons/site_init.py, or a module first imported while reading, such as
+a site tool or a helper SConstruct imports. reset() then unloads SCons,
+enscons and those modules, so SConstruct is read again into fresh SCons
+state, as in a new process.
+"""
+
+import cProfile
+import os
+import sys
+import sysconfig
+
+# modules loaded before SCons; reset() unloads SCons and enscons modules
+# imported after these
+_preloaded = set(sys.modules)
+
+import SCons.Errors
+import SCons.Node
+import SCons.Script
+import SCons.Script.Interactive
+import SCons.Script.Main
+
+# build directory for wheels, sdists and metadata
+PEP517_DIR = os.path.join("build", "pep517")
+
+# files whose change means SConstruct must be read again, besides the
+# SConscripts and modules loaded while reading it
+WATCHED_FILES = (
+    "SConstruct",
+    "pyproject.toml",
+    os.path.join("site_scons", "site_init.py"),
+)
+
+_stdlib = tuple(
+    os.path.join(path, "")
+    for path in {sysconfig.get_path("stdlib"), sysconfig.get_path("platstdlib")}
+)
+_site = tuple(
+    os.path.join(path, "")
+    for path in {sysconfig.get_path("purelib"), sysconfig.get_path("platlib")}
+)
+
+
+def _source_file(module):
+    """
+    Return the Python source module was loaded from, or None for the
+    standard library, extension modules and namespace packages.
+    """
+    path = getattr(module, "__file__", None)
+    if not path or not path.endswith(".py"):
+        return None
+    path = os.path.abspath(path)
+    if path.startswith(_stdlib) and not path.startswith(_site):
+        return None
+    return path
+
+
+def _stamp(paths=WATCHED_FILES):
+    stamp = [os.getcwd()]
+    for name in paths:
+        try:
+            st = os.stat(name)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+def _unload(name):
+    module = sys.modules.pop(name, None)
+    parent, _, child = name.rpartition(".")
+    # "from parent import child" would find the old module on its parent
+    if parent in sys.modules and getattr(sys.modules[parent], child, None) is module:
+        delattr(sys.modules[parent], child)
+
+
+def reset(modules=()):
+    """
+    Forget the nodes, targets and environments of a previous SConstruct by
+    unloading SCons, the enscons modules loaded with it, and modules, the
+    names of the modules imported while reading it. Import enscons.session
+    again afterwards for fresh SCons state.
+    """
+    names = set(modules)
+    for name in sys.modules:
+        if name == "SCons" or name.startswith("SCons."):
+            names.add(name)
+        elif name.startswith("enscons.") and name not in _preloaded:
+            names.add(name)
+    names.add(__name__)
+    # children first, so parents are still loaded to detach them from
+    for name in sorted(names, key=lambda name: -name.count(".")):
+        _unload(name)
+
+
+class Session(object):
+    """
+    SCons state kept between hook calls.
+    """
+
+    def __init__(self, args=()):
+        self.args = list(args)
+        self.watched = list(WATCHED_FILES)
+        self.stamp = _stamp(self.watched)
+        self.modules = []
+        self.command = None
+
+    def _interact(self, fs, parser, options, targets, target_top):
+        # stands in for SCons.Script.Interactive.interact()
+        self.command = SCons.Script.Interactive.SConsInteractiveCmd(
+            prompt="scons>>> ",
+            fs=fs,
+            parser=parser,
+            options=options,
+            targets=targets,
+            target_top=target_top,
+        )
+
+    def read(self):
+        """
+        Read SConstruct without building anything.
+        """
+        sys.argv[1:] = [
+            "--interactive",
+            "--wheel-dir=" + PEP517_DIR,
+            "--dist-dir=" + PEP517_DIR,
+        ] + self.args
+        interact = SCons.Script.Interactive.interact
+        SCons.Script.Interactive.interact = self._interact
+        before = set(sys.modules)
+        try:
+            SCons.Script.Main.main()
+        except SystemExit as e:
+            if e.code != 0:
+                raise
+        finally:
+            SCons.Script.Interactive.interact = interact
+            self._watch(before)
+        if self.command is None:
+            raise SCons.Errors.UserError("SConstruct was not read")
+
+    def _watch(self, before):
+        """
+        Watch the SConscripts read and the modules imported since before.
+        """
+        watched = set(WATCHED_FILES)
+        for node in SCons.Node.SConscriptNodes:
+            watched.add(node.srcnode().rfile().get_abspath())
+        for name in set(sys.modules) - before:
+            path = _source_file(sys.modules[name])
+            if path is not None:
+                self.modules.append(name)
+                watched.add(path)
+        self.watched = sorted(watched)
+        self.stamp = _stamp(self.watched)
+
+    def current(self, args=()):
+        return self.stamp == _stamp(self.watched) and self.args == list(args)
+
+    def reset(self):
+        """
+        Unload this session's SCons state; see reset().
+        """
+        reset(self.modules)
+
+    def build(self, alias, args=(), profile=None):
+        """
+        Build alias with extra command line arguments, returning the path of
+        its first source. With profile, write cProfile statistics for the
+        build to that file, like SCons' --profile.
+        """
+        # do_build() parses these into a copy of the options read with
+        # SConstruct, which GetOption() returns for the rest of the build
+        argv = ["build"] + list(args) + [alias]
+        if profile:
+            prof = cProfile.Profile()
+            try:
+                prof.runcall(self.command.do_build, argv)
+            finally:
+                prof.dump_stats(profile)
+        else:
+            self.command.do_build(argv)
+        status = SCons.Script.Main.this_build_status
+        if status:
+            raise SystemExit(status)
+        # extreme non-api:
+        return str(SCons.Node.arg2nodes_lookups[0](alias).sources[0])
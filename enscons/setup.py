@@ -6,7 +6,6 @@ Now that pyproject.toml is widely supported, this should not be needed.
 """
 
 import sys
-import pkg_resources
 import argparse
 
 
@@ -17,6 +16,7 @@ def develop(path):
     This may work fine with a .dist-info directory in place of .egg-info.
     """
     import os
+    import pkg_resources
     from setuptools.command import easy_install
     from . import paths
 
@@ -71,7 +71,8 @@ def setup():
             sys.argv.append("=".join((flag, getattr(args, arg))))
 
     sys.path[0:0] = ["setup-requires"]
-    pkg_resources.working_set.add_entry("setup-requires")
+    if "pkg_resources" in sys.modules:  # don't pay for importing it otherwise
+        sys.modules["pkg_resources"].working_set.add_entry("setup-requires")
 
     import SCons.Script
 
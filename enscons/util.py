@@ -2,9 +2,9 @@
 Utilities otherwise provided by pkg_resources or wheel
 """
 
+import os
 import re
-from packaging.requirements import Requirement
-import packaging
+import sys
 
 
 # from pkg_resources
@@ -26,6 +26,8 @@ def safe_version(version):
     """
     Convert an arbitrary string to a standard version string
     """
+    import packaging.version
+
     try:
         # normalize the version
         return str(packaging.version.Version(version))
@@ -77,6 +79,8 @@ def generate_requirements(extras_require):
             condition += "extra == '%s'" % extra
 
         for dependency in depends:
+            from packaging.requirements import Requirement
+
             new_req = Requirement(dependency)
             if condition:
                 if new_req.marker:
@@ -84,3 +88,63 @@ def generate_requirements(extras_require):
                 else:
                     new_req.marker = condition
             yield "Requires-Dist", str(new_req)
+
+
+def _read_ints(path):
+    with open(path) as f:
+        return [int(field) for field in f.read().split()]
+
+
+def cgroup_cpu_limit():
+    """
+    Return the CPU quota of this process' cgroup, rounded up, or None.
+    """
+    try:
+        # cgroup v2: "$MAX $PERIOD", or "max $PERIOD" for no limit
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota == "max":
+            return None
+        quota, period = int(quota), int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: quota is -1 for no limit
+            (quota,) = _read_ints("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+            (period,) = _read_ints("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        except (OSError, ValueError):
+            return None
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, -(-quota // period))
+
+
+def cpu_count():
+    """
+    Return the number of CPUs this process may run on, within its affinity
+    mask and cgroup CPU quota.
+    """
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:  # not Linux
+        count = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        count = min(count, limit)
+    return count
+
+
+def user_cache_dir():
+    """
+    Return the directory for enscons' per-user caches: $ENSCONS_CACHE_DIR,
+    or the platform's user cache directory.
+    """
+    path = os.environ.get("ENSCONS_CACHE_DIR")
+    if path:
+        return path
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "enscons", "Cache")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/enscons")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "enscons")
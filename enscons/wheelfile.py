@@ -0,0 +1,819 @@
+"""wheelfile
+
+Tool-specific initialization for wheel archives.
+
+Like SCons' zip builder, but each member is hashed and measured as it is
+compressed, so RECORD is written in the same pass instead of re-reading the
+finished archive. Timestamps are set on each member, so zipfile is never
+patched and other Zip() users in the same build are unaffected.
+"""
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import binascii
+import collections
+import fnmatch
+import functools
+import hashlib
+import os
+import stat
+import struct
+import threading
+import time
+import zipfile
+import zlib
+
+import SCons.Action
+import SCons.Builder
+import SCons.Defaults
+import SCons.Errors
+import SCons.Node.FS
+
+from . import SOURCE_EPOCH_ZIP, jobserver, urlsafe_b64encode
+from .cache import Cache, DEFAULT_CACHE_SIZE
+
+# read and compress members in pieces of this size
+CHUNK_SIZE = 1 << 20
+
+# members larger than this are streamed in CHUNK_SIZE pieces by the writing
+# thread instead of being compressed ahead of time in memory. At most two
+# members per compression thread are held at once, so peak memory does not
+# depend on the size of the largest member.
+MEMBER_BUFFER_LIMIT = 1 << 23
+
+# "auto" compression samples this many pieces of this size from each member,
+# and stores the member if deflate saves less than AUTO_STORE_RATIO of them
+SAMPLE_COUNT = 4
+SAMPLE_SIZE = 1 << 14
+AUTO_STORE_RATIO = 0.95
+
+
+def _data_samples(data):
+    if len(data) <= SAMPLE_COUNT * SAMPLE_SIZE:
+        return [data]
+    step = (len(data) - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+    return [data[i * step : i * step + SAMPLE_SIZE] for i in range(SAMPLE_COUNT)]
+
+
+def _file_samples(filename, size):
+    step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+    samples = []
+    with open(filename, "rb") as f:
+        for i in range(SAMPLE_COUNT):
+            f.seek(i * step)
+            samples.append(f.read(SAMPLE_SIZE))
+    return samples
+
+
+def _compressible(samples):
+    """
+    Return True if a quick deflate of samples shrinks them enough to be worth
+    compressing the whole member.
+    """
+    size = sum(len(sample) for sample in samples)
+    if size < 1024:  # headers would dominate; just deflate it
+        return True
+    compressed = sum(len(zlib.compress(sample, 1)) for sample in samples)
+    return compressed < size * AUTO_STORE_RATIO
+
+
+class CompressionPolicy(object):
+    """
+    Choose the compression of each wheel member.
+
+    rules are (pattern, level) pairs, or a dict, matched in order against the
+    member's archive path with fnmatch. level is 0 to store the member, 1-9
+    to deflate at that level, None for zlib's default level, or "auto" to
+    store members whose sampled contents barely compress and deflate the
+    rest at default, or at zlib's default level when default is 0 or "auto".
+    Members that match no rule use default.
+    """
+
+    def __init__(self, rules=(), default=None):
+        if hasattr(rules, "items"):
+            rules = rules.items()
+        self.rules = list(rules)
+        self.default = default
+
+    def level(self, arcname):
+        for pattern, level in self.rules:
+            if fnmatch.fnmatchcase(arcname, pattern):
+                return level
+        return self.default
+
+    def choose(self, arcname, samples):
+        """
+        Return (compress_type, compresslevel) for arcname. samples is called
+        for a list of pieces of the member's contents if they are needed.
+        """
+        level = self.level(arcname.replace(os.sep, "/"))
+        if level == "auto":
+            if not _compressible(samples()):
+                level = 0
+            elif self.default in (0, "auto"):
+                level = None
+            else:
+                level = self.default
+        if level == 0:
+            return zipfile.ZIP_STORED, None
+        return zipfile.ZIP_DEFLATED, level
+
+
+def _needs_zip64(file_size, compress_size=0):
+    """
+    ZIP64 test matching zipfile.ZipFile.open(), so members streamed through
+    zipfile and members copied as raw compressed data get identical headers.
+    Deflate can expand incompressible data slightly, hence the margin.
+    """
+    return file_size * 1.05 > zipfile.ZIP64_LIMIT or compress_size > zipfile.ZIP64_LIMIT
+
+
+def _compress(data, compress_type, compresslevel):
+    if compress_type == zipfile.ZIP_STORED:
+        return data
+    if compresslevel is None:
+        compresslevel = zlib.Z_DEFAULT_COMPRESSION
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as src:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+def record_digest(digest):
+    return "sha256=" + urlsafe_b64encode(digest).decode("ascii")
+
+
+def read_record(archive, record_path):
+    """
+    Return {arcname: digest} from the RECORD of an open wheel.
+    """
+    digests = {}
+    for line in archive.read(record_path).decode("utf-8").splitlines():
+        name, digest, size = line.rsplit(",", 2)
+        digests[name.replace(",,", ",")] = digest
+    return digests
+
+
+def check_dist_info(path, dist_info):
+    """
+    Raise UserError unless each file in the directory dist_info is in the
+    wheel at path with the same contents, by RECORD digest.
+    """
+    name = os.path.basename(dist_info)
+    with zipfile.ZipFile(path) as archive:
+        digests = read_record(archive, name + "/RECORD")
+    for root, dirs, files in os.walk(dist_info):
+        for filename in files:
+            filepath = os.path.join(root, filename)
+            arcname = "/".join(
+                (name, os.path.relpath(filepath, dist_info).replace(os.sep, "/"))
+            )
+            if arcname == name + "/RECORD":
+                continue
+            if digests.get(arcname) != record_digest(_file_digest(filepath)):
+                raise SCons.Errors.UserError(
+                    "%s in %s does not match the prepared metadata in %s"
+                    % (arcname, path, dist_info)
+                )
+
+
+class Member(object):
+    """
+    A wheel member that has been read, hashed and compressed, ready to be
+    written. data is None for members too large to hold in memory; those are
+    copied from raw_path at raw_offset (a cache entry or an earlier wheel) or
+    compressed while they are written.
+    """
+
+    __slots__ = (
+        "filename",
+        "st_mode",
+        "file_size",
+        "digest",
+        "crc",
+        "data",
+        "raw_path",
+        "raw_offset",
+        "compress_size",
+        "compress_type",
+        "compresslevel",
+    )
+
+    def __init__(self, filename, st_mode, file_size, digest, crc, data):
+        self.filename = filename
+        self.st_mode = st_mode
+        self.file_size = file_size
+        self.digest = digest
+        self.crc = crc
+        self.data = data
+        self.raw_path = None
+        self.raw_offset = 0
+        self.compress_size = None if data is None else len(data)
+        self.compress_type = zipfile.ZIP_DEFLATED
+        self.compresslevel = None
+
+
+def member_key(digest, compress_type, compresslevel):
+    """
+    Return the key of a member's compressed stream: its contents' sha256
+    and the compression type and level it was written with.
+    """
+    return "%s-%s-%s" % (
+        binascii.hexlify(digest).decode("ascii"),
+        compress_type,
+        compresslevel,
+    )
+
+
+class MemberCache(object):
+    """
+    Compressed wheel members in an enscons.cache.Cache, keyed by content
+    sha256 and compression type and level. Each entry is the member's CRC
+    and size followed by its raw compressed stream, ready to be copied into
+    a new archive; the key doubles as the member's RECORD digest.
+    """
+
+    header = struct.Struct("<IQ")
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def key(self, member):
+        return member_key(member.digest, member.compress_type, member.compresslevel)
+
+    def load(self, member):
+        """
+        Fill in member's compressed data from the cache. Return False on a miss.
+        """
+        path = self.cache.get(self.key(member))
+        if path is None:
+            return False
+        try:
+            with open(path, "rb") as f:
+                crc, file_size = self.header.unpack(f.read(self.header.size))
+                if file_size != member.file_size:
+                    return False
+                if file_size <= MEMBER_BUFFER_LIMIT:
+                    member.data = f.read()
+                    member.compress_size = len(member.data)
+                else:
+                    member.raw_path = path
+                    member.raw_offset = self.header.size
+                    member.compress_size = os.fstat(f.fileno()).st_size - f.tell()
+        except (OSError, struct.error):  # evicted or truncated
+            return False
+        member.crc = crc
+        return True
+
+    def store(self, member, raw=None):
+        """
+        Add member to the cache, copying its compressed stream from the file
+        object raw if member.data is None.
+        """
+        with self.cache.writer(self.key(member)) as f:
+            f.write(self.header.pack(member.crc, member.file_size))
+            if member.data is not None:
+                f.write(member.data)
+            else:
+                _copy(raw, f, member.compress_size)
+
+
+def _wheel_stamp(path):
+    st = os.stat(path)
+    return "%d %d" % (st.st_size, st.st_mtime_ns)
+
+
+def write_compression(path, wheel_path, keys):
+    """
+    Write the member_key() of each member of the wheel at wheel_path, as
+    (key, arcname) pairs, to path for PreviousWheel.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(_wheel_stamp(wheel_path) + "\n")
+        for key, arcname in keys:
+            f.write("%s %s\n" % (key, arcname))
+
+
+def read_compression(path, wheel_path):
+    """
+    Return {arcname: key} written by write_compression() for the wheel at
+    wheel_path, or {} if it was written for another build of the wheel.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            if f.readline().rstrip("\n") != _wheel_stamp(wheel_path):
+                return {}
+            keys = {}
+            for line in f:
+                key, arcname = line.rstrip("\n").split(" ", 1)
+                keys[arcname] = key
+            return keys
+    except (OSError, ValueError):
+        return {}
+
+
+class PreviousWheel(object):
+    """
+    Compressed members of an earlier build of a wheel, indexed by their
+    member_key() as listed in compression_path by write_compression(), so
+    unchanged members can be copied into the new wheel without being
+    compressed again. Members are only reused with the compression type and
+    level they would be written with now.
+    """
+
+    def __init__(self, path, compression_path):
+        self.path = path
+        self.members = {}
+        self._lock = threading.Lock()
+        keys = read_compression(compression_path, path)
+        self.fp = open(path, "rb")
+        try:
+            with zipfile.ZipFile(self.fp) as archive:
+                infos = dict((info.filename, info) for info in archive.infolist())
+        except BaseException:
+            self.fp.close()
+            raise
+        for name, key in keys.items():
+            info = infos.get(name)
+            if info is not None:
+                self.members[key] = info
+
+    def load(self, member):
+        """
+        Fill in member's compressed data from the earlier wheel. Return False
+        if it was not there with the same contents and compression.
+        """
+        info = self.members.get(
+            member_key(member.digest, member.compress_type, member.compresslevel)
+        )
+        if (
+            info is None
+            or info.compress_type != member.compress_type
+            or info.file_size != member.file_size
+        ):
+            return False
+        with self._lock:
+            # local header has variable length name and extra fields
+            self.fp.seek(info.header_offset)
+            header = self.fp.read(zipfile.sizeFileHeader)
+            name_length, extra_length = struct.unpack("<HH", header[-4:])
+            offset = info.header_offset + len(header) + name_length + extra_length
+            if member.file_size <= MEMBER_BUFFER_LIMIT:
+                self.fp.seek(offset)
+                member.data = self.fp.read(info.compress_size)
+            else:
+                member.raw_path = self.path
+                member.raw_offset = offset
+        member.crc = info.CRC
+        member.compress_size = info.compress_size
+        return True
+
+    def close(self):
+        self.fp.close()
+
+
+def _copy(src, dest, length):
+    while length > 0:
+        chunk = src.read(min(length, CHUNK_SIZE))
+        if not chunk:
+            raise EOFError("unexpected end of %r" % src)
+        dest.write(chunk)
+        length -= len(chunk)
+
+
+class WheelFile(zipfile.ZipFile):
+    """
+    Write-only ZipFile that records the sha256 digest and size of each member
+    as it is added, and appends RECORD on close().
+
+    Members are compressed by prepare(), which may run on worker threads, and
+    written in order by write_member(). Serial and threaded archives are
+    byte-identical.
+
+    policy is a CompressionPolicy choosing each member's compression; by
+    default every member uses compression and compresslevel.
+    """
+
+    def __init__(
+        self,
+        file,
+        record_path,
+        date_time,
+        compression=zipfile.ZIP_DEFLATED,
+        compresslevel=None,
+        cache=None,
+        previous=None,
+        policy=None,
+    ):
+        zipfile.ZipFile.__init__(
+            self, file, "w", compression=compression, compresslevel=compresslevel
+        )
+        self.record_path = record_path
+        self.date_time = date_time
+        self.records = []
+        # (member_key(), arcname) of each member, for write_compression()
+        self.keys = []
+        self.cache = None
+        if cache is not None:
+            self.cache = MemberCache(cache)
+        self.previous = previous
+        if policy is None:
+            policy = CompressionPolicy(
+                default=0 if compression == zipfile.ZIP_STORED else compresslevel
+            )
+        self.policy = policy
+
+    def _zipinfo(self, arcname, member):
+        zinfo = zipfile.ZipInfo(arcname, self.date_time)
+        zinfo.external_attr = (member.st_mode & 0xFFFF) << 16
+        zinfo.compress_type = member.compress_type
+        zinfo._compresslevel = member.compresslevel
+        return zinfo
+
+    def _record(self, arcname, digest, size):
+        self.records.append((arcname, record_digest(digest), size))
+
+    def _reuse(self, member):
+        """
+        Find member's compressed stream in the previous wheel or the cache.
+        """
+        if self.previous and self.previous.load(member):
+            return True
+        return bool(self.cache and self.cache.load(member))
+
+    def prepare_data(self, data, arcname, st_mode=stat.S_IFREG | 0o644, cache=True):
+        """
+        Hash and compress in-memory data (str is encoded as utf-8) as chosen
+        by the policy for arcname, reusing the compressed stream from the
+        previous wheel or the cache if it has been seen before.
+        """
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        member = Member(
+            None, st_mode, len(data), hashlib.sha256(data).digest(), None, None
+        )
+        member.compress_type, member.compresslevel = self.policy.choose(
+            arcname, lambda: _data_samples(data)
+        )
+        if cache and self._reuse(member):
+            return member
+        cache = cache and self.cache
+        member.crc = zlib.crc32(data)
+        member.data = _compress(data, member.compress_type, member.compresslevel)
+        member.compress_size = len(member.data)
+        if cache:
+            cache.store(member)
+        return member
+
+    def prepare(self, filename, arcname=None):
+        """
+        Read, hash and compress filename. Safe to call from worker threads;
+        zlib and hashlib release the GIL while they work.
+        """
+        arcname = arcname or filename
+        st = os.stat(filename)
+        if st.st_size > MEMBER_BUFFER_LIMIT:
+            member = Member(filename, st.st_mode, st.st_size, None, None, None)
+            member.compress_type, member.compresslevel = self.policy.choose(
+                arcname, lambda: _file_samples(filename, st.st_size)
+            )
+            if self.cache or self.previous:
+                member.digest = _file_digest(filename)
+                self._reuse(member)
+            return member
+        with open(filename, "rb") as src:
+            data = src.read()
+        member = self.prepare_data(data, arcname, st.st_mode)
+        member.filename = filename
+        return member
+
+    def _write_stream(self, zinfo, member):
+        digest = hashlib.sha256()
+        size = 0
+        zip64 = _needs_zip64(member.file_size)
+        with open(member.filename, "rb") as src, self.open(
+            zinfo, "w", force_zip64=zip64
+        ) as dest:
+            data_offset = self.fp.tell()
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                dest.write(chunk)
+        if self.cache:
+            member.crc = zinfo.CRC
+            member.compress_size = zinfo.compress_size
+            self.fp.seek(data_offset)
+            self.cache.store(member, self.fp)
+        return digest.digest(), size
+
+    def _write_compressed(self, zinfo, member):
+        """
+        Write already-compressed member data straight into the archive.
+        """
+        if self._writing:
+            raise ValueError(
+                "Can't write to the ZIP file while there is "
+                "another write handle open on it."
+            )
+        zinfo.file_size = member.file_size
+        zinfo.compress_size = member.compress_size
+        zinfo.CRC = member.crc
+        zinfo.flag_bits = 0
+        zip64 = _needs_zip64(zinfo.file_size, zinfo.compress_size)
+        with self._lock:
+            if self._seekable:
+                self.fp.seek(self.start_dir)
+            zinfo.header_offset = self.fp.tell()
+            self._writecheck(zinfo)
+            self._didModify = True
+            self.fp.write(zinfo.FileHeader(zip64))
+            if member.data is not None:
+                self.fp.write(member.data)
+            else:
+                with open(member.raw_path, "rb") as raw:
+                    raw.seek(member.raw_offset)
+                    _copy(raw, self.fp, member.compress_size)
+            self.start_dir = self.fp.tell()
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+
+    def write_member(self, arcname, member):
+        """
+        Add a Member returned by prepare() or prepare_data() as arcname.
+        """
+        zinfo = self._zipinfo(arcname, member)
+        if member.data is None and member.raw_path is None:
+            zinfo.file_size = member.file_size
+            digest, size = self._write_stream(zinfo, member)
+        else:
+            self._write_compressed(zinfo, member)
+            digest, size = member.digest, member.file_size
+        self._record(zinfo.filename, digest, size)
+        self.keys.append(
+            (
+                member_key(digest, member.compress_type, member.compresslevel),
+                zinfo.filename,
+            )
+        )
+
+    def write(self, filename, arcname=None):
+        """
+        Add filename to the archive as arcname, hashing it while it is
+        compressed.
+        """
+        self.write_member(arcname or filename, self.prepare(filename, arcname))
+
+    def write_files(self, files, threads=1):
+        """
+        Add (filename, arcname) pairs in order, compressing up to threads
+        members at a time.
+        """
+        files = list(files)
+        members = _imap(lambda f: self.prepare(*f), files, threads)
+        for (filename, arcname), member in zip(files, members):
+            self.write_member(arcname, member)
+
+    def writestr(self, arcname, data):
+        """
+        Add a member with contents data (str is encoded as utf-8).
+        """
+        self.write_member(arcname, self.prepare_data(data, arcname))
+
+    def write_record(self):
+        lines = [
+            "%s,%s,%s" % (name.replace(",", ",,"), digest, size)
+            for name, digest, size in self.records
+        ]
+        lines.append(self.record_path + ",,")
+        member = self.prepare_data("\n".join(lines), self.record_path, cache=False)
+        self._write_compressed(self._zipinfo(self.record_path, member), member)
+
+    def close(self):
+        if self.fp is not None:
+            self.write_record()
+        zipfile.ZipFile.close(self)
+
+
+def _imap(func, items, threads):
+    """
+    Yield func(item) for items in order, running up to threads calls at once,
+    each holding a job slot when run under a make jobserver.
+    """
+    if jobserver.get() is not None:
+        func = functools.partial(jobserver.call, func)
+    if threads <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(threads) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            # bound the compressed data held in memory
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _source_files(source, wheel_root, members=None):
+    """
+    Yield (path, arcname) for source files, walking directories in sorted
+    order. Sources named in members, {arcname: path} as recorded by Whl()
+    without staging, are archived from where they are; others are staged
+    under wheel_root. A source archived under several names, which is among
+    the sources once per Whl() call, is visited once.
+    """
+    arcnames = collections.defaultdict(list)
+    for arcname, path in (members or {}).items():
+        arcnames[path].append(arcname)
+    seen = set()
+    for s in source:
+        path = s.get_path()
+        if path in seen:
+            continue
+        seen.add(path)
+        for base in arcnames.get(path) or [os.path.relpath(path, wheel_root)]:
+            if s.isdir():
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    for fname in sorted(filenames):
+                        member = os.path.join(dirpath, fname)
+                        if os.path.isfile(member):
+                            yield member, os.path.join(
+                                base, os.path.relpath(member, path)
+                            )
+            else:
+                yield path, base
+
+
+def wheel(target, source, env):
+    """
+    Archive source files under WHEEL_PATH, plus the editable stubs if
+    WHEEL_EDITABLE, writing RECORD as we go.
+
+    Everything happens in one open/close of the target, with timestamps set
+    per member; no zipfile globals are patched.
+
+    With WHEEL_INCREMENTAL, members whose contents and compression match
+    those of the previous build of the target are copied from it without
+    recompression. Their compression is kept beside WHEEL_PATH, since the
+    archive does not record deflate levels.
+    """
+    record_path = env["DIST_INFO_PATH"].get_path(dir=env["WHEEL_PATH"]) + "/RECORD"
+
+    cache = None
+    if env.get("WHEEL_CACHE_DIR"):
+        cache = Cache(str(env["WHEEL_CACHE_DIR"]), env["WHEEL_CACHE_SIZE"])
+
+    # the target is Precious, so an earlier build may still be there
+    target_path = target[0].get_path()
+    archive_path = target_path
+    incremental = env.get("WHEEL_INCREMENTAL")
+    compression_path = os.path.join(
+        os.path.dirname(os.path.normpath(env["WHEEL_PATH"].get_path())),
+        os.path.basename(target_path) + ".compression",
+    )
+    previous = None
+    if incremental and os.path.exists(target_path):
+        try:
+            previous = PreviousWheel(target_path, compression_path)
+        except (OSError, zipfile.BadZipFile):
+            pass
+        else:
+            archive_path = target_path + ".tmp"
+
+    try:
+        keys = _write_wheel(env, source, archive_path, record_path, cache, previous)
+    finally:
+        if previous is not None:
+            previous.close()
+    if archive_path != target_path:
+        os.replace(archive_path, target_path)
+    if incremental:
+        write_compression(compression_path, target_path, keys)
+
+    if cache is not None:
+        cache.evict()
+
+
+def _write_wheel(env, source, path, record_path, cache, previous):
+    from . import editable_files
+
+    wheel_root = env["WHEEL_PATH"].get_path()
+
+    with WheelFile(
+        path,
+        record_path,
+        time.gmtime(SOURCE_EPOCH_ZIP)[:6],
+        cache=cache,
+        previous=previous,
+        policy=CompressionPolicy(
+            env.get("WHEEL_COMPRESSION_POLICY") or (),
+            default=env.get("WHEEL_COMPRESSLEVEL"),
+        ),
+    ) as archive:
+        archive.write_files(
+            _source_files(source, wheel_root, env.get("WHEEL_MEMBERS")),
+            threads=_compress_threads(env),
+        )
+        if env.get("WHEEL_EDITABLE"):
+            for arcname, data in editable_files(env):
+                archive.writestr(arcname, data)
+    return archive.keys
+
+
+def _compress_threads(env):
+    threads = env.get("WHEEL_COMPRESS_THREADS")
+    if threads is None:
+        import SCons.Script
+
+        threads = SCons.Script.GetOption("num_jobs")
+    threads = threads or 1
+    if threads == "auto":
+        from .util import cpu_count
+
+        threads = cpu_count()
+    return int(threads)
+
+
+WheelAction = SCons.Action.Action(
+    wheel,
+    varlist=[
+        "WHEEL_COMPRESSLEVEL",
+        "WHEEL_COMPRESSION_POLICY",
+        "WHEEL_EDITABLE",
+        "WHEEL_MEMBERS",
+    ],
+)
+
+WheelBuilder = SCons.Builder.Builder(
+    action=SCons.Action.Action("$WHEELCOM", "$WHEELCOMSTR"),
+    source_factory=SCons.Node.FS.Entry,
+    source_scanner=SCons.Defaults.DirScanner,
+    multi=True,
+)
+
+
+def generate(env):
+    """Add Builders and construction variables for wheels to an Environment."""
+    try:
+        bld = env["BUILDERS"]["WheelZip"]
+    except KeyError:
+        bld = WheelBuilder
+        env["BUILDERS"]["WheelZip"] = bld
+
+    env["WHEELCOM"] = WheelAction
+    env["WHEEL_COMPRESSLEVEL"] = None  # None = zlib default
+    # [(pattern, level), ...] overriding WHEEL_COMPRESSLEVEL per member;
+    # see CompressionPolicy
+    env["WHEEL_COMPRESSION_POLICY"] = []
+    env["WHEEL_EDITABLE"] = False  # True = add editables stub modules
+    # compress members on a thread pool; N, "auto", or None = as many as -j.
+    # Output is unchanged.
+    env["WHEEL_COMPRESS_THREADS"] = None
+    # reuse compressed members from this directory; None = no cache
+    env["WHEEL_CACHE_DIR"] = None
+    env["WHEEL_CACHE_SIZE"] = DEFAULT_CACHE_SIZE
+    # copy unchanged members from the previous build of the same wheel
+    env["WHEEL_INCREMENTAL"] = False
+    # False = Whl() records archive names and the wheel reads members from
+    # their sources, instead of copying them under WHEEL_PATH
+    env.SetDefault(WHEEL_STAGING=True)
+
+
+def exists(env):
+    """Standard library zipfile should always exist."""
+    return True
@@ -0,0 +1,105 @@
+"""
+Warm PEP 517 sessions read SConstruct again, into fresh SCons state, when a
+file it was read from changes.
+"""
+
+import os
+import subprocess
+import sys
+import tarfile
+import textwrap
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PYPROJECT = """\
+[project]
+name = "warm"
+version = "1.0"
+description = "warm session test"
+
+[tool.enscons]
+wheel-tag = "py3-none-any"
+"""
+
+SCONSTRUCT = """\
+import enscons
+import enscons.toml as toml
+import helper
+
+metadata = toml.load(open("pyproject.toml", "rb"))["project"]
+env = Environment(
+    tools=["default", "packaging", enscons.generate],
+    PACKAGE_METADATA=metadata,
+    WHEEL_TAG="py3-none-any",
+)
+SConscript("SConscript", exports="env")
+env.WhlFile(env.Whl("purelib", Glob("warm/*.py"), root="."))
+extra = helper.EXTRA + env["EXTRA"]
+env.SDist(source=FindSourceFiles() + ["PKG-INFO", "CHANGES"] + extra)
+"""
+
+SCONSCRIPT = """\
+Import("env")
+env["EXTRA"] = []
+"""
+
+
+def project(tmp_path):
+    files = {
+        "pyproject.toml": PYPROJECT,
+        "SConstruct": SCONSTRUCT,
+        "SConscript": SCONSCRIPT,
+        "CHANGES": "1.0\n",
+        "NOTES": "notes\n",
+        "site_scons/helper.py": "EXTRA = []\n",
+        "warm/__init__.py": "",
+    }
+    for name, text in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    return tmp_path
+
+
+def run_hooks(tmp_path, edit, text):
+    """
+    Build an sdist, append text to edit, and build another in the same
+    process. Return the member names of both archives.
+    """
+    script = textwrap.dedent("""\
+        import enscons.api
+        enscons.api.build_sdist("dist1")
+        with open(%r, "a") as f:
+            f.write(%r)
+        enscons.api.build_sdist("dist2")
+        """ % (edit, text))
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env, check=True)
+    names = []
+    for directory in ("dist1", "dist2"):
+        with tarfile.open(tmp_path / directory / "warm-1.0.tar.gz") as archive:
+            names.append(archive.getnames())
+    return names
+
+
+def test_edit_sconstruct(tmp_path):
+    first, second = run_hooks(project(tmp_path), "SConstruct", "\n# edited\n")
+    assert "warm-1.0/CHANGES" in second
+    assert len(second) == len(set(second))
+    assert sorted(first) == sorted(second)
+
+
+@pytest.mark.parametrize(
+    "edit, text",
+    [
+        ("SConscript", "env['EXTRA'] = ['NOTES']\n"),
+        ("site_scons/helper.py", "EXTRA = ['NOTES']\n"),
+    ],
+)
+def test_edit_read_file(tmp_path, edit, text):
+    first, second = run_hooks(project(tmp_path), edit, text)
+    assert "warm-1.0/NOTES" not in first
+    assert "warm-1.0/NOTES" in second
+    assert len(second) == len(set(second))
@@ -0,0 +1,220 @@
+"""
+Wheels built incrementally match clean builds, and ZIP64 wheels verify
+whether members are compressed, loaded from the cache or copied from the
+previous wheel.
+"""
+
+import hashlib
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+import zipfile
+
+import pytest
+
+from enscons import SOURCE_EPOCH_ZIP, wheelfile
+from enscons.cache import Cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PYPROJECT = """\
+[project]
+name = "big"
+version = "1.0"
+description = "incremental wheel test"
+"""
+
+SCONSTRUCT = """\
+import enscons
+import enscons.toml as toml
+
+metadata = toml.load(open("pyproject.toml", "rb"))["project"]
+env = Environment(
+    tools=["default", "packaging", enscons.generate],
+    PACKAGE_METADATA=metadata,
+    WHEEL_TAG="py3-none-any",
+    WHEEL_INCREMENTAL=True,
+    WHEEL_COMPRESSLEVEL=int(ARGUMENTS.get("level", 6)),
+    WHEEL_COMPRESSION_POLICY=[("*.txt", int(ARGUMENTS.get("txt", 6)))],
+)
+env.WhlFile(env.Whl("purelib", Glob("big/*"), root="."))
+"""
+
+WHEEL = "dist/big-1.0-py3-none-any.whl"
+
+
+def project(path):
+    (path / "big").mkdir(parents=True)
+    (path / "pyproject.toml").write_text(PYPROJECT)
+    (path / "SConstruct").write_text(SCONSTRUCT)
+    # compressible, but differently at each level
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+    rng = random.Random(0)
+    for name in ("big/__init__.py", "big/data.txt"):
+        text = " ".join(rng.choice(words) for _ in range(50000))
+        (path / name).write_text(text)
+    return path
+
+
+def scons(path, *args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run(
+        [sys.executable, "-m", "SCons", "-Q"] + list(args),
+        cwd=path,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    with open(os.path.join(path, WHEEL), "rb") as f:
+        return f.read()
+
+
+def test_incremental_recompresses_changed_levels(tmp_path):
+    incremental = project(tmp_path / "incremental")
+    scons(incremental, "level=1", "txt=1")
+    for settings in (("level=9", "txt=1"), ("level=9", "txt=9")):
+        rebuilt = scons(incremental, *settings)
+        clean = tmp_path / "clean"
+        shutil.rmtree(clean, ignore_errors=True)
+        assert rebuilt == scons(project(clean), *settings)
+
+
+@pytest.mark.parametrize("default, level", [(None, None), (9, 9), (0, None)])
+def test_auto_deflates_at_default_level(default, level):
+    policy = wheelfile.CompressionPolicy([("*.txt", "auto")], default=default)
+    choose = policy.choose("big/data.txt", lambda: [b"a" * 4096])
+    assert choose == (zipfile.ZIP_DEFLATED, level)
+    choose = policy.choose("big/data.txt", lambda: [os.urandom(4096)])
+    assert choose == (zipfile.ZIP_STORED, None)
+
+
+UNSTAGED = """\
+import enscons
+import enscons.toml as toml
+
+metadata = toml.load(open("pyproject.toml", "rb"))["project"]
+env = Environment(
+    tools=["default", "packaging", enscons.generate],
+    PACKAGE_METADATA=metadata,
+    WHEEL_TAG="py3-none-any",
+    WHEEL_STAGING=False,
+)
+init = "big/__init__.py"
+env.WhlFile(env.Whl("purelib", init, root=".") + env.Whl("data", init, root="."))
+"""
+
+
+def test_unstaged_source_in_two_categories(tmp_path):
+    path = project(tmp_path)
+    (path / "SConstruct").write_text(UNSTAGED)
+    scons(path)
+    with zipfile.ZipFile(str(path / WHEEL)) as archive:
+        names = archive.namelist()
+        record = archive.read("big-1.0.dist-info/RECORD").decode("utf-8")
+    rows = [line.rsplit(",", 2)[0] for line in record.splitlines()]
+    assert len(names) == len(set(names))
+    assert sorted(rows) == sorted(names)
+    assert "big/__init__.py" in names
+    assert "big-1.0.data/data/big/__init__.py" in names
+
+
+RECORD = "zip64-1.0.dist-info/RECORD"
+
+DATE_TIME = time.gmtime(SOURCE_EPOCH_ZIP)[:6]
+
+
+def many_members(path):
+    """
+    More members than the 65535 a ZIP without ZIP64 can hold.
+    """
+    return [("data", "m/%d.txt" % i, b"%d" % i) for i in range(1 << 16 | 1)]
+
+
+def huge_member(path):
+    """
+    A sparse member larger than 4 GiB.
+    """
+    filename = str(path / "huge.bin")
+    with open(filename, "wb") as f:
+        f.truncate(zipfile.ZIP64_LIMIT + 1)
+    return [("file", "zip64/huge.bin", filename), ("data", "zip64/small.txt", b"x")]
+
+
+def write_wheel(path, members, cache=None, previous=None):
+    with wheelfile.WheelFile(
+        str(path),
+        RECORD,
+        DATE_TIME,
+        compresslevel=1,
+        cache=cache,
+        previous=previous,
+    ) as archive:
+        for kind, arcname, value in members:
+            if kind == "file":
+                archive.write(value, arcname)
+            else:
+                archive.writestr(arcname, value)
+    return archive.keys
+
+
+def check_wheel(path, count):
+    with zipfile.ZipFile(str(path)) as archive:
+        assert archive.testzip() is None
+        infos = archive.infolist()
+        assert len(infos) == count + 1
+        records = {}
+        for line in archive.read(RECORD).decode("utf-8").splitlines():
+            name, digest, size = line.rsplit(",", 2)
+            records[name] = (digest, size)
+        assert records.pop(RECORD) == ("", "")
+        assert len(records) == count
+        for info in infos:
+            if info.filename == RECORD:
+                continue
+            digest = hashlib.sha256()
+            with archive.open(info) as member:
+                for chunk in iter(lambda: member.read(wheelfile.CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            assert records[info.filename] == (
+                wheelfile.record_digest(digest.digest()),
+                str(info.file_size),
+            )
+
+
+@pytest.mark.parametrize("members", [many_members, huge_member])
+def test_zip64(tmp_path, monkeypatch, members):
+    members = members(tmp_path)
+    cache = Cache(str(tmp_path / "cache"))
+    first = tmp_path / "first.whl"
+    keys = write_wheel(first, members, cache=cache)
+    check_wheel(first, len(members))
+
+    # from here on only RECORD is compressed
+    compressed = []
+    compress = wheelfile._compress
+    monkeypatch.setattr(
+        wheelfile,
+        "_compress",
+        lambda *args: compressed.append(args) or compress(*args),
+    )
+    monkeypatch.setattr(wheelfile.WheelFile, "_write_stream", None)
+
+    cached = tmp_path / "cached.whl"
+    write_wheel(cached, members, cache=cache)
+    check_wheel(cached, len(members))
+    assert cached.read_bytes() == first.read_bytes()
+
+    compression = str(tmp_path / "first.whl.compression")
+    wheelfile.write_compression(compression, str(first), keys)
+    previous = wheelfile.PreviousWheel(str(first), compression)
+    incremental = tmp_path / "incremental.whl"
+    try:
+        write_wheel(incremental, members, previous=previous)
+    finally:
+        previous.close()
+    check_wheel(incremental, len(members))
+    assert incremental.read_bytes() == first.read_bytes()
+    assert len(compressed) == 2